@@ -11,8 +11,10 @@ Change by: SM
 ...
 """
 
+import os
 from operator import itemgetter
-import cdsapi
+
+from instrumentation import stage
 
 
 class DataRequest:
@@ -179,14 +181,16 @@ class DataRequest:
 
 def download_climate_data(request_text):
     """Method uses cdsapi Client to get the requested data"""
+    import cdsapi
+
     try:
         c = cdsapi.Client()
-    except Exception:  # too broad exception, narrow it
-        print(Exception)
-        print('Follow tutorial here: https://cds.climate.copernicus.eu/api-how-to to configure an api')
-        return 0
-    else:
+    except Exception as e:  # too broad exception, narrow it
+        raise RuntimeError('Client of the Climate Data Store is not configured ({}). Follow tutorial here: '
+                           'https://cds.climate.copernicus.eu/api-how-to to configure an api'.format(e)) from e
+    with stage('download', source='era5', variable=request_text[1]['variable']) as record:
         c.retrieve(request_text[0], request_text[1], request_text[2])
+        record.add_file(written_bytes=os.path.getsize(request_text[2]))
 
 
 if __name__ == '__main__':
@@ -14,9 +14,10 @@ Change by: SM
 ...
 """
 
+import os
 from operator import itemgetter
-import elevation
-import pyproj
+
+from instrumentation import stage
 
 
 class DEMRequest:
@@ -25,10 +26,12 @@ class DEMRequest:
         self.interactive = interactive
         self.destination_folder = output_folder
         self.bounds = bounds
-        if crs is not None:
-            self.initial_crs = pyproj.Proj(crs)
+        self.destination_crs_type = 'EPSG:4326'  # geodetic coordinates in the WGS84 refernce system EPSG:4326
+        self.initial_crs = crs
+        # Bounds without crs are already given as the geodetic coordinates
+        self.destination_points = bounds
+        if crs is not None and bounds is not None:
             self.destination_points = self._reproject()
-        self.destination_crs_type = {'init': 'epsg:4326'}  # geodetic coordinates in the WGS84 refernce system EPSG:4326
         available_datasets = self._initialize_datasets()
         self.data_dict = available_datasets[0]
         self.datasets_description = available_datasets[1]
@@ -65,9 +68,10 @@ class DEMRequest:
         return data_type_dict, description_text
 
     def _reproject(self):
-        wgs84 = pyproj.Proj(self.destination_crs_type)
-        first_pair = pyproj.transform(self.initial_crs, wgs84, self.bounds[0], self.bounds[1])
-        second_pair = pyproj.transform(self.initial_crs, wgs84, self.bounds[2], self.bounds[3])
+        from pyproj import Transformer
+        transformer = Transformer.from_crs(self.initial_crs, self.destination_crs_type, always_xy=True)
+        first_pair = transformer.transform(self.bounds[0], self.bounds[1])
+        second_pair = transformer.transform(self.bounds[2], self.bounds[3])
         destination_points = (first_pair[0], first_pair[1], second_pair[0], second_pair[1])
         return destination_points
 
@@ -97,14 +101,20 @@ class DEMRequest:
         return input_info
 
     def download_area(self, srtm_model=1):
+        import elevation
+
         if self.interactive:
             input_information = self._get_input_data()
         else:
             input_information = [self.data_dict[srtm_model], self.destination_points, self.destination_folder]
 
-        elevation.clip(product=input_information[0], bounds=tuple(input_information[1]), output=input_information[2])
-        # clean up stale temporary files and fix the cache in the event of a server error
-        elevation.clean()
+        with stage('download', source='srtm', product=input_information[0]) as record:
+            elevation.clip(product=input_information[0], bounds=tuple(input_information[1]),
+                           output=input_information[2])
+            # clean up stale temporary files and fix the cache in the event of a server error
+            elevation.clean()
+            if os.path.exists(input_information[2]):
+                record.add_file(written_bytes=os.path.getsize(input_information[2]))
 
     def __str__(self):
         output = ''
@@ -16,8 +16,10 @@ Change by: SM
 ...
 """
 
+import os
 from operator import itemgetter
-import pymodis
+
+from instrumentation import stage
 
 
 class ModisRequest:
@@ -85,6 +87,8 @@ class ModisRequest:
         output filename without '.hdf' ending]
         :return: cds api request
         """
+        from pymodis import downmodis
+
         if self.interactive:
             input_information = self._get_input_data()
 
@@ -96,14 +100,14 @@ class ModisRequest:
         if password is None:
             password = input('Please, provide your password and press RETURN:\n')
 
-        downloading_object = pymodis.downmodis.downModis(destinationFolder=input_information[4],
-                                                         password=password,
-                                                         user=username,
-                                                         tiles=input_information[1],
-                                                         path='MOLT',
-                                                         product=variable,
-                                                         today=input_information[2],
-                                                         enddate=input_information[3])
+        downloading_object = downmodis.downModis(destinationFolder=input_information[4],
+                                                 password=password,
+                                                 user=username,
+                                                 tiles=input_information[1],
+                                                 path='MOLT',
+                                                 product=variable,
+                                                 today=input_information[2],
+                                                 enddate=input_information[3])
         self.modis_request = downloading_object
         return downloading_object
 
@@ -143,8 +147,13 @@ class ModisRequest:
         return input_info
 
     def get_modis_data(self):
-        self.modis_request.connect()
-        self.modis_request.downloadsAllDay()
+        destination = self.modis_request.writeFilePath
+        with stage('download', source='modis', product=self.modis_request.product) as record:
+            files_before = set(os.listdir(destination)) if os.path.isdir(destination) else set()
+            self.modis_request.connect()
+            self.modis_request.downloadsAllDay()
+            for f in set(os.listdir(destination)) - files_before:
+                record.add_file(written_bytes=os.path.getsize(os.path.join(destination, f)))
         return True
 
     def __str__(self):
@@ -8,8 +8,7 @@ Change by: SM
 ...
 """
 
-from pygbif import occurrences as occ
-from pygbif import species as sps
+from instrumentation import stage
 
 class SpeciesRequest:
 
@@ -39,6 +38,9 @@ class SpeciesRequest:
         return self.information
 
     def download_area(self, user=None, password=None, email=None):
+        from pygbif import occurrences as occ
+        from pygbif import species as sps
+
         if self.interactive:
             input_information = self._get_input_data()
         else:
@@ -55,7 +57,8 @@ class SpeciesRequest:
         ct = 'country = ' + self.information[1]
         hascoo = 'hasCoordinate = TRUE'
         hasissues = 'hasGeospatialIssue = False'
-        data = occ.download([tk, ct, hascoo, hasissues], user=user, pwd=password, email=email)
+        with stage('download', source='gbif', species=self.information[0]):
+            data = occ.download([tk, ct, hascoo, hasissues], user=user, pwd=password, email=email)
         return data
 
 if __name__ == '__main__':
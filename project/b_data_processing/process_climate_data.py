@@ -0,0 +1,425 @@
+"""Climate Data Processing functions
+Scripts in this module align ERA5 reanalysis (hourly data on the regular latitude / longitude grid in the NetCDF
+format) with the MODIS composites of the ModisProcessing class.
+Module processes:
+a) hourly ERA5 fields into monthly means, the NetCDF file is read in chunks of time steps,
+b) monthly means into the same groups as ModisProcessing: all months, years, seasons (SEASONS dictionary of the
+process_raster_data module) and months of each year,
+c) grids: bilinear weights from the ERA5 grid to the MODIS grid are computed once as a sparse matrix and stored,
+resampling of all fields is a single sparse matrix product.
+
+Groups are means of the monthly means, each month has the same weight as in the MODIS composites of monthly
+products (as example MOD11B3).
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from b_data_processing.process_raster_data import SEASONS
+from b_data_processing.scripts.process_modis import BandMetadata, export_composite
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+TIME_NAMES = ('time', 'valid_time')
+LATITUDE_NAMES = ('latitude', 'lat')
+LONGITUDE_NAMES = ('longitude', 'lon')
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       TEMPORAL AGGREGATION                                                       ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def month_index(times):
+    """Function returns number of months since January 1970 for datetimes (numpy datetime64 or datetime objects)"""
+    return np.asarray(times, dtype='datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+
+def month_to_date(month_ids):
+    """Function returns (years, months) arrays of the month indices returned by the month_index()"""
+    month_ids = np.asarray(month_ids)
+    return month_ids // 12 + 1970, month_ids % 12 + 1
+
+
+def aggregate_by_month(fields, month_ids):
+    """
+    Function sums fields over months. Time steps are sorted by month and summed with a single np.add.reduceat.
+    :param fields: (time, rows, cols) array, NaN values are not included in sums,
+    :param month_ids: month index of each time step (see month_index()),
+    :return: unique month indices, (months, rows, cols) sums, (months, rows, cols) counts of valid values
+    """
+    month_ids = np.asarray(month_ids)
+    if np.any(np.diff(month_ids) < 0):
+        order = np.argsort(month_ids, kind='stable')
+        month_ids = month_ids[order]
+        fields = fields[order]
+    unique_ids, starts = np.unique(month_ids, return_index=True)
+    valid = np.isfinite(fields)
+    if valid.all():
+        # Usual case without missing values, counts are numbers of time steps in months
+        sums = np.add.reduceat(fields.astype(np.float64, copy=False), starts, axis=0)
+        lengths = np.diff(np.append(starts, len(month_ids)))
+        counts = np.broadcast_to(lengths.reshape((-1,) + (1,) * (fields.ndim - 1)), sums.shape)
+    else:
+        sums = np.add.reduceat(np.where(valid, fields, 0).astype(np.float64, copy=False), starts, axis=0)
+        counts = np.add.reduceat(valid.astype(np.int32), starts, axis=0)
+    return unique_ids, sums, counts
+
+
+def group_months(month_ids, grouping_method='all', years_limit=None, months_limit=range(1, 13)):
+    """
+    Function assigns months to the groups of the ModisProcessing.create_time_series() grouping methods.
+    :param month_ids: month indices (see month_index()),
+    :param grouping_method: 'all', 'by_year', 'by_season_all', 'by_season' or 'full',
+    :param years_limit: years included in groups, if None then all years are included,
+    :param months_limit: months (1-12) included in groups,
+    :return: dictionary {group name: boolean array of months in the group}, names are: 'all', 'YYYY', season names,
+    'season_YYYY' and 'MM-YYYY' respectively
+    """
+    years, months = month_to_date(month_ids)
+    selected = np.isin(months, list(months_limit))
+    if years_limit is not None:
+        selected &= np.isin(years, list(years_limit))
+
+    groups = {}
+    if grouping_method == 'all':
+        groups['all'] = selected
+    elif grouping_method == 'by_year':
+        for year in np.unique(years[selected]):
+            groups[str(year)] = selected & (years == year)
+    elif grouping_method == 'by_season_all':
+        for season_name, season in SEASONS.items():
+            groups[season_name] = selected & np.isin(months, season)
+    elif grouping_method == 'by_season':
+        for year in np.unique(years[selected]):
+            for season_name, season in SEASONS.items():
+                groups['{}_{}'.format(season_name, year)] = selected & (years == year) & np.isin(months, season)
+    elif grouping_method == 'full':
+        for month_id in month_ids[selected]:
+            year, month = month_to_date(month_id)
+            groups['{:02d}-{}'.format(month, year)] = month_ids == month_id
+    else:
+        raise KeyError('Grouping method {} is not available'.format(grouping_method))
+    return {name: members for name, members in groups.items() if members.any()}
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       SPATIAL RESAMPLING                                                         ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def _fractional_index(coordinates, values, periodic=False):
+    # Index of the lower neighbor and the distance to it (from 0 to 1) of values on the ascending axis
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    indices = np.arange(len(coordinates))
+    if periodic:
+        values = coordinates[0] + np.mod(values - coordinates[0], 360.0)
+        coordinates = np.append(coordinates, coordinates[0] + 360.0)
+        indices = np.append(indices, 0)
+    lower = np.clip(np.searchsorted(coordinates, values, side='right') - 1, 0, len(coordinates) - 2)
+    fraction = (values - coordinates[lower]) / (coordinates[lower + 1] - coordinates[lower])
+    inside = (values >= coordinates[0]) & (values <= coordinates[-1])
+    return indices[lower], indices[lower + 1], fraction, inside
+
+
+def bilinear_weights(latitudes, longitudes, geotransform, shape, projection):
+    """
+    Function computes bilinear weights from the regular latitude / longitude grid (as example ERA5) to the centers of
+    pixels of the destination grid (as example MODIS sinusoidal grid).
+    :param latitudes: latitudes of the source grid rows, ascending or descending,
+    :param longitudes: longitudes of the source grid columns, ascending, from -180 to 180 or from 0 to 360,
+    :param geotransform: GDAL geotransform of the destination grid,
+    :param shape: (rows, cols) of the destination grid,
+    :param projection: WKT or other CRS definition of the destination grid accepted by pyproj,
+    :return: scipy.sparse CSR matrix (destination pixels, source pixels), rows of destination pixels outside the source
+    grid are empty
+    """
+    from pyproj import Transformer
+    from scipy import sparse
+
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    rows, cols = np.indices(shape)
+    xs = geotransform[0] + (cols + 0.5) * geotransform[1] + (rows + 0.5) * geotransform[2]
+    ys = geotransform[3] + (cols + 0.5) * geotransform[4] + (rows + 0.5) * geotransform[5]
+    transformer = Transformer.from_crs(projection, 'EPSG:4326', always_xy=True)
+    lons, lats = transformer.transform(xs.ravel(), ys.ravel())
+
+    # Latitudes of ERA5 are descending, their order is reversed for the search and mapped back by indices
+    lat_order = np.argsort(latitudes)
+    lat_low, lat_high, lat_fraction, lat_inside = _fractional_index(latitudes[lat_order], lats)
+    lat_low, lat_high = lat_order[lat_low], lat_order[lat_high]
+    step = np.abs(np.diff(longitudes)).mean() if len(longitudes) > 1 else 360.0
+    periodic = longitudes[-1] - longitudes[0] + step >= 360.0 - 1e-6
+    lon_low, lon_high, lon_fraction, lon_inside = _fractional_index(longitudes, lons, periodic)
+
+    inside = np.flatnonzero(lat_inside & lon_inside & np.isfinite(lons) & np.isfinite(lats))
+    destination = np.repeat(inside, 4)
+    source = np.stack((lat_low * len(longitudes) + lon_low,
+                       lat_low * len(longitudes) + lon_high,
+                       lat_high * len(longitudes) + lon_low,
+                       lat_high * len(longitudes) + lon_high), axis=1)[inside].ravel()
+    weights = np.stack(((1 - lat_fraction) * (1 - lon_fraction),
+                        (1 - lat_fraction) * lon_fraction,
+                        lat_fraction * (1 - lon_fraction),
+                        lat_fraction * lon_fraction), axis=1)[inside].ravel()
+    matrix = sparse.csr_matrix((weights, (destination, source)),
+                               shape=(shape[0] * shape[1], len(latitudes) * len(longitudes)))
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def weights_grid(latitudes, longitudes, geotransform, shape, projection):
+    """Function returns description of the source and destination grids of weights, stored with them by the
+    save_weights() and compared by the same_grid()"""
+    from pyproj import CRS
+
+    return {'latitudes': np.asarray(latitudes, dtype=np.float64),
+            'longitudes': np.asarray(longitudes, dtype=np.float64),
+            'geotransform': np.asarray(geotransform, dtype=np.float64),
+            'destination_shape': np.asarray(shape, dtype=np.int64),
+            'projection': CRS.from_user_input(projection).to_wkt()}
+
+
+def same_grid(grid, other_grid):
+    """Function checks if two descriptions returned by the weights_grid() describe the same grids"""
+    for name in ('latitudes', 'longitudes', 'geotransform', 'destination_shape'):
+        if grid[name].shape != other_grid[name].shape or not np.allclose(grid[name], other_grid[name]):
+            return False
+    return str(grid['projection']) == str(other_grid['projection'])
+
+
+def save_weights(weights_file, weights, grid):
+    """Function stores sparse weights with the description of grids (see weights_grid()) in the .npz file. File is
+    written under the given name, also without the .npz suffix."""
+    folder = os.path.dirname(weights_file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # np.savez appends .npz to the file names, but not to the open files
+    temporary_file = '{}.{}.tmp'.format(weights_file, os.getpid())
+    with open(temporary_file, 'wb') as stored:
+        np.savez(stored, data=weights.data, indices=weights.indices, indptr=weights.indptr,
+                 matrix_shape=weights.shape, **grid)
+    os.replace(temporary_file, weights_file)
+
+
+def load_weights(weights_file):
+    """Function returns sparse weights and the description of grids stored by the save_weights(), description is None
+    if the file does not store it"""
+    from scipy import sparse
+
+    with np.load(weights_file) as stored:
+        weights = sparse.csr_matrix((stored['data'], stored['indices'], stored['indptr']),
+                                    shape=tuple(stored['matrix_shape']))
+        grid = None
+        if all(name in stored for name in ('latitudes', 'longitudes', 'geotransform', 'destination_shape',
+                                           'projection')):
+            grid = {name: stored[name] for name in ('latitudes', 'longitudes', 'geotransform', 'destination_shape')}
+            grid['projection'] = str(stored['projection'])
+    return weights, grid
+
+
+def resample(fields, weights, shape):
+    """
+    Function resamples fields with precomputed weights, all fields are resampled by one sparse matrix product.
+    Source NaN values are excluded and the weights of their neighbors are normalized.
+    :param fields: (rows, cols) or (time, rows, cols) array on the source grid,
+    :param weights: sparse matrix returned by the bilinear_weights(),
+    :param shape: (rows, cols) of the destination grid,
+    :return: array (destination rows, destination cols) or (time, destination rows, destination cols), pixels
+    outside the source grid are NaN
+    """
+    single = fields.ndim == 2
+    flat = fields.reshape(1 if single else fields.shape[0], -1).T
+    valid = np.isfinite(flat)
+    if valid.all():
+        resampled = weights @ flat
+        total_weight = np.broadcast_to(np.asarray(weights.sum(axis=1)), resampled.shape)
+    else:
+        resampled = weights @ np.where(valid, flat, 0)
+        total_weight = weights @ valid.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        resampled = np.where(total_weight > 0, resampled / total_weight, np.nan)
+    resampled = resampled.T.reshape((-1,) + tuple(shape)).astype(np.float32)
+    return resampled[0] if single else resampled
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       ERA5 PROCESSING                                                            ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def _read_chunk(variable, start, stop):
+    # Scale, offset and fill values are applied directly on numpy arrays, masked arrays are much slower
+    raw = variable[start:stop]
+    values = raw.astype(np.float64)
+    for attribute in ('_FillValue', 'missing_value'):
+        if hasattr(variable, attribute):
+            values[raw == getattr(variable, attribute)] = np.nan
+    if hasattr(variable, 'scale_factor'):
+        values *= variable.scale_factor
+    if hasattr(variable, 'add_offset'):
+        values += variable.add_offset
+    return values
+
+
+def _find_variable(dataset, names):
+    for name in names:
+        if name in dataset.variables:
+            return dataset.variables[name]
+    raise KeyError('None of variables {} found in the NetCDF file'.format(names))
+
+
+class ClimateProcessing:
+    """Class aggregates hourly ERA5 data into the groups of the ModisProcessing and resamples them to the MODIS grid.
+
+    Usage:
+        cp = ClimateProcessing('t2m_2018.nc', variable='t2m')
+        cp.set_destination_grid(metadata.geotransform, shape, metadata.projection, weights_file='era5_h18v03.npz')
+        seasons = cp.create_time_series(grouping_method='by_season_all', years_limit=range(2018, 2019))
+    """
+
+    def __init__(self, netcdf_file, variable=None, chunk_size=744):
+        """
+        :param netcdf_file: ERA5 file from the DataRequest,
+        :param variable: name of the variable in the file, as example 't2m', if None then the first variable with
+        time, latitude and longitude dimensions is used,
+        :param chunk_size: number of time steps read at once, default is one month of hourly data.
+        """
+        self.file = netcdf_file
+        self.variable = variable
+        self.chunk_size = chunk_size
+        self.latitudes = None
+        self.longitudes = None
+        self.month_ids = None
+        self.monthly_means = None
+        self.weights = None
+        self.destination_shape = None
+        self.destination_metadata = None
+        self.exported_files = {}
+
+    def _data_variable(self, dataset):
+        if self.variable is not None:
+            return dataset.variables[self.variable]
+        for name, variable in dataset.variables.items():
+            if len(variable.dimensions) >= 3 and variable.dimensions[0] in TIME_NAMES:
+                self.variable = name
+                return variable
+        raise KeyError('File {} has no variable with time, latitude and longitude dimensions'.format(self.file))
+
+    def _read_grid(self):
+        import netCDF4
+
+        with netCDF4.Dataset(self.file, 'r') as dataset:
+            self.latitudes = np.asarray(_find_variable(dataset, LATITUDE_NAMES)[:], dtype=np.float64)
+            self.longitudes = np.asarray(_find_variable(dataset, LONGITUDE_NAMES)[:], dtype=np.float64)
+
+    def read_monthly_means(self):
+        """Method reads the NetCDF file in chunks of time steps and returns (month indices, (months, rows, cols)
+        monthly means). Monthly means are computed once and stored in the object."""
+        if self.monthly_means is not None:
+            return self.month_ids, self.monthly_means
+
+        import netCDF4
+
+        with stage('composite', source='era5', file=os.path.basename(self.file)) as record, \
+                netCDF4.Dataset(self.file, 'r') as dataset:
+            times = _find_variable(dataset, TIME_NAMES)
+            dates = netCDF4.num2date(times[:], times.units, getattr(times, 'calendar', 'standard'),
+                                     only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+            time_month_ids = month_index(dates)
+            self.latitudes = np.asarray(_find_variable(dataset, LATITUDE_NAMES)[:], dtype=np.float64)
+            self.longitudes = np.asarray(_find_variable(dataset, LONGITUDE_NAMES)[:], dtype=np.float64)
+            data = self._data_variable(dataset)
+            data.set_auto_maskandscale(False)
+
+            self.month_ids = np.unique(time_month_ids)
+            sums = np.zeros((len(self.month_ids), len(self.latitudes), len(self.longitudes)), dtype=np.float64)
+            counts = np.zeros(sums.shape, dtype=np.int64)
+            for start in range(0, len(time_month_ids), self.chunk_size):
+                chunk = _read_chunk(data, start, start + self.chunk_size)
+                if chunk.ndim == 4:
+                    # ERA5 with the expver dimension: final (1) and preliminary (5) data do not overlap
+                    chunk = np.fmax.reduce(chunk, axis=1)
+                chunk_ids, chunk_sums, chunk_counts = aggregate_by_month(
+                    chunk, time_month_ids[start:start + self.chunk_size])
+                positions = np.searchsorted(self.month_ids, chunk_ids)
+                sums[positions] += chunk_sums
+                counts[positions] += chunk_counts
+            record.add_file(read_bytes=os.path.getsize(self.file))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.monthly_means = np.where(counts > 0, sums / counts, np.nan)
+        return self.month_ids, self.monthly_means
+
+    def set_destination_grid(self, geotransform, shape, projection, weights_file=None):
+        """
+        Method sets the grid of the MODIS composites as the destination of resampling.
+        :param geotransform: GDAL geotransform, as example BandMetadata.geotransform of the composite,
+        :param shape: (rows, cols) of the composite,
+        :param projection: WKT of the composite projection (as example BandMetadata.projection) or other CRS
+        definition accepted by pyproj,
+        :param weights_file: optional .npz file with weights, weights are loaded from it if it exists and it was
+        computed for the same ERA5 grid, geotransform, shape and projection, otherwise they are computed and stored
+        in it.
+        """
+        if self.latitudes is None:
+            self._read_grid()
+        grid = weights_grid(self.latitudes, self.longitudes, geotransform, shape, projection)
+
+        self.weights = None
+        if weights_file is not None and os.path.exists(weights_file):
+            weights, stored_grid = load_weights(weights_file)
+            if stored_grid is not None and same_grid(grid, stored_grid):
+                self.weights = weights
+            else:
+                logger.warning('Weights from {} are computed for the other ERA5 or destination grid, they are '
+                               'computed again'.format(weights_file))
+        if self.weights is None:
+            self.weights = bilinear_weights(self.latitudes, self.longitudes, geotransform, shape, projection)
+            if weights_file is not None:
+                save_weights(weights_file, self.weights, grid)
+
+        self.destination_shape = tuple(shape)
+        self.destination_metadata = BandMetadata(dtype=np.dtype(np.float32), scale=1.0, offset=0.0, nodata=np.nan,
+                                                 geotransform=tuple(geotransform), projection=grid['projection'])
+
+    def create_time_series(self, grouping_method='all', years_limit=None, months_limit=range(1, 13),
+                           output_directory=''):
+        """
+        Method computes means of the monthly means in the groups of the ModisProcessing.create_time_series().
+        :param grouping_method: 'all', 'by_year', 'by_season_all', 'by_season' or 'full' (see group_months()),
+        :param years_limit: Python range of years to be included in the analysis,
+        :param months_limit: Python range of months to be included in the analysis,
+        :param output_directory: if given and the destination grid is set then groups are stored there as GeoTIFFs
+        era5_<variable>_<group name>.tif, their paths are available in the exported_files dictionary,
+        :return: dictionary {group name: (rows, cols) array}, on the destination grid if it is set
+        """
+        month_ids, monthly_means = self.read_monthly_means()
+        groups = group_months(month_ids, grouping_method, years_limit, months_limit)
+        if not groups:
+            return {}
+
+        # Group means of all groups are computed with one matrix product of the membership matrix and monthly means
+        membership = np.stack(list(groups.values())).astype(np.float64)
+        flat = monthly_means.reshape(len(month_ids), -1)
+        valid = np.isfinite(flat)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (membership @ np.where(valid, flat, 0)) / (membership @ valid)
+        means = means.reshape((len(groups),) + monthly_means.shape[1:])
+
+        if self.weights is not None:
+            means = resample(means, self.weights, self.destination_shape)
+            if output_directory:
+                os.makedirs(output_directory, exist_ok=True)
+                for group_name, mean in zip(groups, means):
+                    output_path = os.path.join(output_directory, 'era5_{}_{}.tif'.format(self.variable, group_name))
+                    self.exported_files[group_name] = export_composite(mean, self.destination_metadata, output_path)
+        return dict(zip(groups, means))
@@ -16,11 +16,20 @@ Change by: SM
 
 import os
 import numpy as np
-import tempfile
-import rasterio as rio
-from scripts.prepare_files import get_filelist
-from scripts.prepare_files import create_modis_dataframe
-from scripts.process_modis import hdf_to_tiff
+from b_data_processing.scripts.prepare_files import get_filelist
+from b_data_processing.scripts.prepare_files import create_modis_dataframe
+from b_data_processing.scripts.prepare_files import LOOKUP_TABLE_LEAP, LOOKUP_TABLE_REGULAR
+from b_data_processing.scripts.process_modis import read_subdatasets, qc_lookup_table, qc_mask, export_composite
+from b_data_processing.scripts.mosaic import build_mosaic, reproject_mosaic
+from b_data_processing.scripts.prefetch import PrefetchReader
+from instrumentation import stage
+
+SEASONS = {
+    'spring': [3, 4, 5],
+    'summer': [6, 7, 8],
+    'autumn': [9, 10, 11],
+    'winter': [1, 2, 12]
+}
 
 ########################################################################################################################
 ###                                                                                                                  ###
@@ -29,18 +38,59 @@ from scripts.process_modis import hdf_to_tiff
 ########################################################################################################################
 
 def read_band(band_address):
+    import rasterio as rio
     with rio.open(band_address[0], 'r') as src:
         band = src.read()
     return band
 
 class ModisProcessing:
     """Class process Modis datasets stored in the given folder. The main method calculates means or medians of the
-    given time series. Additional methods retrieves point values for a given coordinates."""
+    given time series. Additional methods retrieves point values for a given coordinates.
+
+    Each HDF file is read once: all subdatasets and their QC layers are decoded in a single pass, each QC layer is
+    decoded once and its mask is applied to the subdatasets which it describes. Bands and composites are kept in the native (usually integer) dtype
+    of the subdataset, scale and offset are applied only when composites are exported into the output directory."""
 
-    def __init__(self, lookup_table_leap='additional_data/lut_modis/julian_day_calendar_leap.csv',
-                 lookup_table_regular='additional_data/lut_modis/julian_day_calendar_regular.csv',
-                 subdatasets = [0]):
+    def __init__(self, lookup_table_leap=LOOKUP_TABLE_LEAP, lookup_table_regular=LOOKUP_TABLE_REGULAR,
+                 subdatasets = [0], qc_subdataset=None, qc_flags=None, prefetch=2,
+                 band_cache=None):
+        """
+        :param lookup_table_leap: csv with julian days of the leap year,
+        :param lookup_table_regular: csv with julian days of the regular year,
+        :param subdatasets: list of subdatasets indices to process, as example [0, 4] for LST Day and LST Night
+        of the MOD11B3 product,
+        :param qc_subdataset: dictionary {subdataset: index of its QC subdataset}, as example {0: 1, 4: 5} for
+        LST Day with QC_Day and LST Night with QC_Night of the MOD11B3 product, subdatasets without the QC
+        subdataset are not masked. Single index is used as the QC subdataset of all subdatasets. If None then only
+        no data values are rejected,
+        :param qc_flags: list of (first bit, number of bits, accepted values) describing accepted QC values, as
+        example QC_FLAGS['MOD11'] from the process_modis script, required if qc_subdataset is given,
+        :param prefetch: number of HDF files decoded in background threads while the current file is added to the
+        composite, 0 disables prefetching,
+        :param band_cache: optional BandCache from the band_cache script, decoded subdatasets are reused between
+        grouping methods, tiles queries and ModisProcessing objects which share the cache.
+        """
+        if type(subdatasets) == int:
+            subdatasets = [subdatasets]
+        if qc_subdataset is not None and not qc_flags:
+            raise ValueError('QC subdataset {} is given without qc_flags, pass accepted QC values as example '
+                             'QC_FLAGS[\'MOD11\'] from the process_modis script'.format(qc_subdataset))
+        if qc_subdataset is None:
+            qc_subdataset = {}
+        elif not isinstance(qc_subdataset, dict):
+            qc_subdataset = {subset: qc_subdataset for subset in subdatasets}
+        # Keys of the dictionary read from the toml or yaml config are strings
+        qc_subdataset = {int(subset): int(qc_subset) for subset, qc_subset in qc_subdataset.items()}
+        unknown = set(qc_subdataset) - set(subdatasets)
+        if unknown:
+            raise ValueError('QC subdatasets are given for subdatasets {} which are not processed'.format(
+                sorted(unknown)))
         self.subsets = subdatasets
+        self.qc_subsets = qc_subdataset
+        self.qc_flags = qc_flags
+        self.qc_luts = {}
+        self.prefetch = prefetch
+        self.band_cache = band_cache
         self.tiles_types = []
         self.tiles_list = []
         self.grouping = {
@@ -56,6 +106,9 @@ class ModisProcessing:
         self.tiles_dict = None
         self.created_bands = []
         self.temporary_band = None
+        self.output_folder = ''
+        self.bands_metadata = {}
+        self.exported_files = {}
 
     ####################################################################################################################
     ###                                                                                                              ###
@@ -70,7 +123,9 @@ class ModisProcessing:
         with: [[date 1, file 1], [date 2, file 2], ..., [date 999, file 999]] where date is in the format 'MM-YYYY'
         or 'YYYY' and file is returned as a full path to the processed .tif file/
         :param input_directory: full path to the directory with hdf files,
-        :param output_directory: full path to the directory where files must be stored,
+        :param output_directory: full path to the directory where files must be stored, if not given then composites
+        are only returned. Stored composites are Float32 GeoTIFFs with scaled values, their paths are available in the
+        exported_files dictionary {(group name, subdataset): [file of tile 1, file of tile 2, ...]},
         :param grouping_method: available methods:
         'all' -> sums over all tiles and returns their average as a single band,
         'by_year' -> sums over the years and returns list of tiles average for each year,
@@ -93,17 +148,22 @@ class ModisProcessing:
         :return output_files: list with: [[date 1, file 1], [date 2, file 2], ..., [date 999, file 999]]
         """
 
-        self.tiles_list = get_filelist(input_directory, tiles_type, '.hdf')
-        self.input_folder = input_directory
-        df = self._prepare_frame(years_limit, months_limit, tiles_type)
-        merged_tiles = self.grouping[grouping_method](df, tiles_type)
+        with stage('composite', grouping=grouping_method, tiles=tiles_type) as record:
+            self.tiles_list = get_filelist(input_directory, tiles_type, '.hdf')
+            self.input_folder = input_directory
+            self.output_folder = output_directory
+            df = self._prepare_frame(years_limit, months_limit, tiles_type)
+            merged_tiles = self.grouping[grouping_method](df, tiles_type)
+            record.files_processed = len(df)
         return merged_tiles
 
     def _merge_all(self, modis_dataframe, tiles):
         for tile in tiles:
             tile_df = modis_dataframe[modis_dataframe['tile type'].isin([tile])]
             list_of_files = list(tile_df['filename'])
-            self.created_bands.append(self._process_eo(list_of_files))
+            mean_bands, metadata = self._process_eo(list_of_files)
+            self._store(tile, 'all', mean_bands, metadata)
+            self.created_bands.append(mean_bands)
         return self.created_bands
 
 
@@ -111,19 +171,14 @@ class ModisProcessing:
         pass
 
     def _merge_by_season_all(self, modis_dataframe, tiles):
-        spring = [3, 4, 5]
-        summer = [6, 7, 8]
-        autumn = [9, 10, 11]
-        winter = [1, 2, 12]
-
-        seasons = [spring, summer, autumn, winter]
         for tile in tiles:
             tile_df = modis_dataframe[modis_dataframe['tile type'].isin([tile])]
             bands = []
-            for season in seasons:
+            for season_name, season in SEASONS.items():
                 df = tile_df[tile_df['month'].isin(season)]
                 list_of_files = list(df['filename'])
-                mean_band = self._process_eo(list_of_files)
+                mean_band, metadata = self._process_eo(list_of_files)
+                self._store(tile, season_name, mean_band, metadata)
                 bands.append(mean_band)
             self.created_bands.append(bands)
         return self.created_bands
@@ -143,27 +198,129 @@ class ModisProcessing:
         self.tiles_dict = modis_data_updated
         return modis_data_updated
 
+    def _quality_mask(self, qc_band):
+        # Lookup tables with 256 or 65536 entries are computed once for each QC dtype
+        bits = qc_band.dtype.itemsize * 8
+        if bits not in self.qc_luts:
+            self.qc_luts[bits] = qc_lookup_table(self.qc_flags, bits)
+        return qc_mask(qc_band, self.qc_luts[bits])
+
+    def _qc_datasets(self):
+        # Each QC layer is read once, even if it describes many subdatasets
+        return sorted(set(self.qc_subsets.values()))
+
+    def _split_quality(self, bands, metadata):
+        # Returns bands of subdatasets with their metadata and the QC mask of each subdataset (None if not masked)
+        number_of_subsets = len(self.subsets)
+        masks = {qc_subset: self._quality_mask(qc_band)
+                 for qc_subset, qc_band in zip(self._qc_datasets(), bands[number_of_subsets:])}
+        quality = [masks.get(self.qc_subsets.get(subset)) for subset in self.subsets]
+        return (bands[:number_of_subsets], metadata[:number_of_subsets]), quality
+
+    def _read_files(self, list_of_files):
+        # All subdatasets and QC layers are decoded in one pass over each HDF file. Bands are valid only until
+        # the next file is requested, their buffers are reused by the prefetching reader.
+        datasets = list(self.subsets) + self._qc_datasets()
+        paths = [os.path.join(self.input_folder, file) for file in list_of_files]
+        read = read_subdatasets if self.band_cache is None else self.band_cache.read_subdatasets
+
+        if self.prefetch and len(paths) > 1:
+            with PrefetchReader(paths, datasets, depth=self.prefetch, reader=read) as reader:
+                for _, bands, metadata in reader:
+                    yield self._split_quality(bands, metadata)
+        else:
+            for path in paths:
+                yield self._split_quality(*read(path, datasets))
+
+    @staticmethod
+    def _nodata(metadata):
+        # Subdatasets without the fill value use 0 as no data
+        return 0 if metadata.nodata is None else metadata.nodata
+
+    @staticmethod
+    def _accumulator(band):
+        # Integer bands are summed exactly in int64, floating point bands in float64
+        if np.issubdtype(band.dtype, np.integer):
+            return np.zeros(band.shape, dtype=np.int64)
+        return np.zeros(band.shape, dtype=np.float64)
+
+    def _mean(self, band_sum, band_count, metadata):
+        # Mean is rounded back into the native dtype, pixels without valid values get the no data value
+        mean = np.full(band_sum.shape, self._nodata(metadata), dtype=metadata.dtype)
+        has_values = band_count > 0
+        if np.issubdtype(metadata.dtype, np.integer):
+            counts = band_count[has_values].astype(np.int64)
+            mean[has_values] = (2 * band_sum[has_values] + counts) // (2 * counts)
+        else:
+            mean[has_values] = band_sum[has_values] / band_count[has_values]
+        return mean
+
     def _process_eo(self, list_of_files):
-        bands = []
-
-        for file in list_of_files:
-            with tempfile.TemporaryDirectory() as tmpdict:
-                tiff_band = hdf_to_tiff(self.input_folder, [file], tmpdict, self.subsets)
-
-                # Read band and store it, calculate mean if self.created_bands is not empty
-                if len(bands) == 0:
-                    bands.append(read_band(tiff_band)[0])
-                else:
-                    new_band = read_band(tiff_band)[0]
-
-                    average = (bands[0] + new_band) / 2
-                    nb = (new_band==0)
-                    bb = (bands[0]==0)
-                    average[nb] = new_band[nb] + bands[0][nb]
-                    average[bb] = new_band[bb] + bands[0][bb]
-
-                    bands[0] = average
-        return bands
+        """Method returns list with the mean of each subdataset over the list of files and list with BandMetadata of
+        subdatasets. Means are in the native dtype of subdatasets. Pixels rejected by the QC layer and no data pixels
+        are not included in the mean, pixels without any valid value are set to the no data value (or 0)."""
+        sums = None
+        counts = None
+        metadata = []
+
+        for (bands, metadata), qualities in self._read_files(list_of_files):
+            if sums is None:
+                sums = [self._accumulator(band) for band in bands]
+                counts = [np.zeros(band.shape, dtype=np.uint32) for band in bands]
+
+            for band, band_metadata, quality, band_sum, band_count in zip(bands, metadata, qualities, sums, counts):
+                valid = band != self._nodata(band_metadata)
+                if not np.issubdtype(band.dtype, np.integer):
+                    valid &= np.isfinite(band)
+                if quality is not None:
+                    valid &= quality
+                np.add(band_sum, band, out=band_sum, where=valid)
+                band_count += valid
+
+        if sums is None:
+            return [], []
+        means = [self._mean(band_sum, band_count, band_metadata)
+                 for band_sum, band_count, band_metadata in zip(sums, counts, metadata)]
+        return means, metadata
+
+    def _store(self, tile, group_name, mean_bands, metadata):
+        # Composites are materialized as scaled float values only when they are exported
+        self.bands_metadata[tile] = metadata
+        if not self.output_folder:
+            return
+        os.makedirs(self.output_folder, exist_ok=True)
+        for subdataset, band, band_metadata in zip(self.subsets, mean_bands, metadata):
+            filename = 'mod_{}_{}_{}.tif'.format(tile, group_name, subdataset)
+            output_path = export_composite(band, band_metadata, os.path.join(self.output_folder, filename))
+            self.exported_files.setdefault((group_name, subdataset), []).append(output_path)
+
+    ####################################################################################################################
+    ###                                                                                                              ###
+    ###                                       MOSAICKING                                                             ###
+    ###                                                                                                              ###
+    ####################################################################################################################
+
+    def mosaic_composites(self, destination_crs=None, resolution=None, resampling='near', materialize=False):
+        """
+        Method joins exported per-tile composites into a single virtual raster for each group and subdataset, so
+        the area spanning tile boundaries may be clipped and sampled as one raster. Composites must be exported
+        first, with create_time_series(output_directory=...).
+        :param destination_crs: if given then mosaic is reprojected (once) from the sinusoidal grid into this CRS,
+        :param resolution: (x resolution, y resolution) of the reprojected mosaic,
+        :param resampling: GDAL resampling method of the reprojection,
+        :param materialize: if True then reprojected mosaic is written as GeoTIFF, otherwise as warped VRT,
+        :return mosaics: dictionary {(group name, subdataset): path to the mosaic}
+        """
+        mosaics = {}
+        for (group_name, subdataset), files in self.exported_files.items():
+            name = 'mosaic_{}_{}'.format(group_name, subdataset)
+            mosaic = build_mosaic(files, os.path.join(self.output_folder, name + '.vrt'))
+            if destination_crs is not None:
+                extension = '.tif' if materialize else '.vrt'
+                mosaic = reproject_mosaic(mosaic, os.path.join(self.output_folder, name + '_warped' + extension),
+                                          destination_crs, resolution, resampling, materialize)
+            mosaics[(group_name, subdataset)] = mosaic
+        return mosaics
 
     ####################################################################################################################
     ###                                                                                                              ###
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from b_data_processing.scripts.process_modis import read_subdatasets
+
+logger = logging.getLogger(__name__)
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def band_key(path, subdataset=0, window=None):
+    """
+    Function returns cache key of the decoded band. Modification time and size of the file are the part of the key,
+    so bands of the changed files are decoded again.
+    :param path: path to the raster or HDF file,
+    :param subdataset: index of the HDF subdataset or number of the raster band,
+    :param window: None for the whole band or ((row start, row stop), (col start, col stop)),
+    :return: (absolute path, subdataset, window, mtime in ns, size in bytes)
+    """
+    stat = os.stat(path)
+    if window is not None:
+        window = tuple(tuple(int(i) for i in w) for w in window)
+    return os.path.abspath(path), subdataset, window, stat.st_mtime_ns, stat.st_size
+
+
+class BandCache:
+    """Class stores decoded bands up to the byte budget and evicts the least recently used bands.
+
+    Bands are kept in the process memory or, if the directory is given, as .npy files opened with the memory map.
+    Directory in the shared memory (as example /dev/shm/sdm_bands) allows pool workers and other processes with
+    the BandCache over the same directory to read bands decoded once, without copies. Cached bands are read-only.
+
+    Usage:
+        cache = BandCache(max_bytes=2 * 1024 ** 3, directory='/dev/shm/sdm_bands')
+        mp = ModisProcessing(subdatasets=[0, 4], band_cache=cache)
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, directory=None):
+        """
+        :param max_bytes: memory budget of the cache in bytes,
+        :param directory: None for the in-memory cache, otherwise folder for memory mapped .npy files.
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _file_name(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.npy'), os.path.join(self.directory, name + '.meta')
+
+    def _load_shared(self, key):
+        # Band may be already decoded by the other process which uses the same directory
+        band_file, meta_file = self._file_name(key)
+        try:
+            band = np.load(band_file, mmap_mode='r')
+            with open(meta_file, 'rb') as meta:
+                metadata = pickle.load(meta)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        return band, metadata
+
+    def _store_shared(self, key, band, metadata):
+        # Files are written under temporary names and renamed, readers never see partial files
+        band_file, meta_file = self._file_name(key)
+        suffix = '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+        with open(meta_file + suffix, 'wb') as meta:
+            pickle.dump(metadata, meta)
+        with open(band_file + suffix, 'wb') as npy:
+            np.save(npy, band)
+        os.replace(meta_file + suffix, meta_file)
+        os.replace(band_file + suffix, band_file)
+        return np.load(band_file, mmap_mode='r')
+
+    def _remove_shared(self, key):
+        for file in self._file_name(key):
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+    def _add(self, key, band, metadata):
+        if band.nbytes > self.max_bytes:
+            return band
+        if self.directory is not None:
+            band = self._store_shared(key, band, metadata)
+        else:
+            # Read-only view protects the cached band, the array of the caller stays writeable
+            band = band.view()
+            band.flags.writeable = False
+        self._entries[key] = (band, metadata)
+        self.size = self.size + band.nbytes
+        while self.size > self.max_bytes:
+            self._evict()
+        return band
+
+    def _evict(self):
+        key, (band, _) = self._entries.popitem(last=False)
+        self.size = self.size - band.nbytes
+        self.evictions = self.evictions + 1
+        if self.directory is not None:
+            # Processes which have mapped the band keep reading it, unlinked file is freed when they finish
+            self._remove_shared(key)
+
+    def get(self, key):
+        """Method returns (band, metadata) stored under the key or None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return self._entries[key]
+            if self.directory is not None:
+                shared = self._load_shared(key)
+                if shared is not None:
+                    self.hits = self.hits + 1
+                    self._entries[key] = shared
+                    self.size = self.size + shared[0].nbytes
+                    while self.size > self.max_bytes:
+                        self._evict()
+                    return shared
+            self.misses = self.misses + 1
+            return None
+
+    def put(self, key, band, metadata=None):
+        """Method stores band under the key and returns the cached (read-only) band"""
+        with self._lock:
+            if key in self._entries:
+                old_band, _ = self._entries.pop(key)
+                self.size = self.size - old_band.nbytes
+            return self._add(key, band, metadata)
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                self._evict()
+            self.evictions = 0
+
+    def read_subdatasets(self, path_to_file, datasets, out=None):
+        """
+        Cached version of the process_modis.read_subdatasets(), it may be passed as the reader of the PrefetchReader.
+        Only subdatasets missing in the cache are decoded, all of them in one pass over the file. Buffers given in
+        out are not used, cached bands must not be overwritten.
+        :return: list of read-only numpy arrays in the order of datasets, list of BandMetadata
+        """
+        if type(datasets) == int:
+            datasets = [datasets]
+        keys = [band_key(path_to_file, ds) for ds in datasets]
+        cached = [self.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+        if missing:
+            bands, metadata = read_subdatasets(path_to_file, [datasets[i] for i in missing])
+            for i, band, band_metadata in zip(missing, bands, metadata):
+                cached[i] = (self.put(keys[i], band, band_metadata), band_metadata)
+        return [entry[0] for entry in cached], [entry[1] for entry in cached]
+
+    def read_raster(self, raster_file, band=1, window=None):
+        """
+        Method returns band of the raster (as example GeoTIFF) read with rasterio, or its window.
+        :param raster_file: path to the raster,
+        :param band: number of the band, from 1,
+        :param window: None for the whole band or ((row start, row stop), (col start, col stop)),
+        :return: read-only numpy array, {'transform': affine transform of the array, 'crs': crs, 'nodata': nodata}
+        """
+        key = band_key(raster_file, band, window)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        import rasterio as rio
+
+        with rio.open(raster_file, 'r') as source:
+            array = source.read(band, window=window)
+            transform = source.transform if window is None else source.window_transform(window)
+            metadata = {'transform': transform, 'crs': source.crs, 'nodata': source.nodata}
+        return self.put(key, array, metadata), metadata
+
+    def statistics(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'bands': len(self._entries),
+                'bytes': self.size, 'max_bytes': self.max_bytes}
+
+
+def shared_cache(max_bytes=1024 ** 3, directory=None):
+    """Function returns BandCache shared by all callers in the process with the same directory, so stages of the
+    pipeline (as example composites with different grouping methods) reuse decoded bands."""
+    with _shared_caches_lock:
+        if directory not in _shared_caches:
+            _shared_caches[directory] = BandCache(max_bytes, directory)
+        cache = _shared_caches[directory]
+        cache.max_bytes = max(cache.max_bytes, max_bytes)
+        return cache
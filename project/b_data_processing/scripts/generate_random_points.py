@@ -1,14 +1,26 @@
 import numpy as np
-import rasterio as rio
+
+from instrumentation import stage
 
 
 class RandomSubset:
 
-    def __init__(self, band_file):
+    def __init__(self, band_file, band_cache=None):
+        """
+        :param band_file: path to the raster,
+        :param band_cache: optional BandCache from the band_cache script, then the band is decoded once for all
+        subsets of the same raster. Cached band is read-only.
+        """
+        import rasterio as rio
+
         self.file = band_file
-        with rio.open(band_file, 'r') as f:
-            self.band = f.read(1)
-            self.transformation_matrix = f.transform
+        if band_cache is not None:
+            self.band, metadata = band_cache.read_raster(band_file, 1)
+            self.transformation_matrix = metadata['transform']
+        else:
+            with rio.open(band_file, 'r') as f:
+                self.band = f.read(1)
+                self.transformation_matrix = f.transform
         self.random_coordinates = []
         self.coordinates_list = []
 
@@ -33,12 +45,49 @@ class RandomSubset:
         self.random_coordinates = random_coordinates
         return random_coordinates
 
+    def get_background_coordinates(self, presences, number_of_points, buffer_distance=0, seed=None):
+        """
+        Method draws background (pseudo-absence) pixels instead of the uniform random pixels. Only pixels with values
+        greater than 0 are drawn, each pixel at most once, and pixels closer than the buffer_distance to any presence
+        are excluded.
+        :param presences: (n, 2) array of x, y coordinates of presences in the CRS of the raster,
+        :param number_of_points: number of background points,
+        :param buffer_distance: radius of the exclusion buffer around presences, in the units of the raster CRS,
+        :param seed: random seed,
+        :return: array of (col, row) pairs, as get_random_coordinates()
+        """
+        from b_data_processing.scripts.spatial_index import OccurrenceIndex
+
+        index = OccurrenceIndex(presences)
+        rows, cols = index.sample_background(self.band > 0, self.transformation_matrix, number_of_points,
+                                             buffer_distance=buffer_distance, seed=seed)
+        self.random_coordinates = np.stack((cols, rows), axis=1)
+        return self.random_coordinates
+
     def get_values(self):
-        for coordinate in self.random_coordinates:
-            value = self.band[coordinate[1], coordinate[0]]
-            if value > 0:
-                transformed_coordinates = self.transformation_matrix * (coordinate[0], coordinate[1])
-                self.coordinates_list.append([transformed_coordinates[0], transformed_coordinates[1], value])
-            else:
-                pass
-        return self.coordinates_list
\ No newline at end of file
+        with stage('sample', raster=self.file) as record:
+            for coordinate in self.random_coordinates:
+                value = self.band[coordinate[1], coordinate[0]]
+                if value > 0:
+                    transformed_coordinates = self.transformation_matrix * (coordinate[0], coordinate[1])
+                    self.coordinates_list.append([transformed_coordinates[0], transformed_coordinates[1], value])
+                else:
+                    pass
+            record.add_file(read_bytes=self.band.nbytes)
+        return self.coordinates_list
+
+    def iter_values(self, batch_size=100000):
+        """Generator version of get_values(). Yields dictionaries {'x': array, 'y': array, 'value': array} with at most
+        batch_size points, only points with values greater than 0 are returned."""
+        for start in range(0, len(self.random_coordinates), batch_size):
+            with stage('sample', raster=self.file, batch=start // batch_size):
+                coordinates = np.asarray(self.random_coordinates[start:start + batch_size])
+                cols = coordinates[:, 0]
+                rows = coordinates[:, 1]
+                values = self.band[rows, cols]
+                positive = values > 0
+                xs, ys = self.transformation_matrix * (cols[positive], rows[positive])
+                batch = {'x': np.asarray(xs, dtype=np.float64),
+                         'y': np.asarray(ys, dtype=np.float64),
+                         'value': values[positive]}
+            yield batch
\ No newline at end of file
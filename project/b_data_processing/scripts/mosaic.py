@@ -0,0 +1,83 @@
+import os
+
+from instrumentation import stage
+
+
+def build_mosaic(raster_files, output_vrt, nodata=None):
+    """
+    Function builds virtual raster (GDAL VRT) over the rasters, as example per-tile composites of MODIS data. Pixels
+    are not copied, readers of the VRT read only windows of the source rasters which they need.
+    :param raster_files: list of rasters or GDAL subdataset names in the same projection,
+    :param output_vrt: path to the .vrt file,
+    :param nodata: no data value of the sources and the mosaic, if None then no data values of sources are used,
+    :return: output_vrt
+    """
+    from osgeo import gdal
+
+    options = {}
+    if nodata is not None:
+        options = {'srcNodata': nodata, 'VRTNodata': nodata}
+    with stage('mosaic', vrt=os.path.basename(output_vrt), sources=len(raster_files)):
+        vrt = gdal.BuildVRT(output_vrt, list(raster_files), options=gdal.BuildVRTOptions(**options))
+        if vrt is None:
+            raise ValueError('Mosaic {} cannot be built from {}'.format(output_vrt, raster_files))
+        vrt.FlushCache()
+        del vrt
+    return output_vrt
+
+
+def mosaic_subdatasets(base_folder_modis, list_of_files, dataset, output_vrt):
+    """
+    Function builds virtual raster directly over the subdataset of the raw HDF files, as example over the LST Day
+    subdataset of the h18v03, h18v04, h19v03 and h19v04 tiles from the same month.
+    :param base_folder_modis: folder with the HDF files,
+    :param list_of_files: list of the HDF files names,
+    :param dataset: index of the subdataset,
+    :param output_vrt: path to the .vrt file,
+    :return: output_vrt
+    """
+    from osgeo import gdal
+
+    sources = []
+    for f in list_of_files:
+        modis_data = gdal.Open(os.path.join(base_folder_modis, f))
+        sources.append(modis_data.GetSubDatasets()[dataset][0])
+        del modis_data
+    return build_mosaic(sources, output_vrt)
+
+
+def reproject_mosaic(mosaic, output_path, destination_crs, resolution=None, resampling='near', materialize=False):
+    """
+    Function reprojects mosaic, as example from the MODIS sinusoidal grid into the study area CRS, in a single warp.
+    :param mosaic: path to the .vrt (or any raster),
+    :param output_path: path to the output, .vrt if the result is not materialized,
+    :param destination_crs: destination CRS, as example 'EPSG:3035',
+    :param resolution: (x resolution, y resolution) in the units of the destination CRS, if None then GDAL
+    computes resolution close to the source,
+    :param resampling: GDAL resampling method: 'near', 'bilinear', 'cubic', 'average'...,
+    :param materialize: if False then warped VRT is created and pixels are reprojected on read, if True then tiled
+    GeoTIFF is written once,
+    :return: output_path
+    """
+    from osgeo import gdal
+
+    options = {'dstSRS': destination_crs, 'resampleAlg': resampling, 'multithread': True}
+    if resolution is not None:
+        options['xRes'] = resolution[0]
+        options['yRes'] = resolution[1]
+    if materialize:
+        options['format'] = 'GTiff'
+        options['creationOptions'] = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER']
+        options['warpOptions'] = ['NUM_THREADS=ALL_CPUS']
+    else:
+        options['format'] = 'VRT'
+
+    with stage('mosaic', raster=os.path.basename(output_path), crs=destination_crs) as record:
+        warped = gdal.Warp(output_path, mosaic, options=gdal.WarpOptions(**options))
+        if warped is None:
+            raise ValueError('Mosaic {} cannot be reprojected into {}'.format(mosaic, destination_crs))
+        warped.FlushCache()
+        del warped
+        if materialize:
+            record.add_file(written_bytes=os.path.getsize(output_path))
+    return output_path
@@ -0,0 +1,129 @@
+import queue
+import threading
+
+from b_data_processing.scripts.process_modis import read_subdatasets
+
+_DONE = object()
+
+
+class PrefetchReader:
+    """Class decodes HDF files in background threads while the main thread processes already decoded files. GDAL
+    releases the GIL during reads, so decoding of the next files overlaps with the processing of the current one.
+
+    Decoded bands are stored in a ring of depth + 1 reusable buffers: at most depth files are decoded ahead and one
+    file is processed by the consumer, so memory use is capped by the depth. Bands of the file returned by the
+    iterator are valid until the next file is requested, then their buffers are reused.
+
+    Usage:
+        with PrefetchReader(paths, datasets=[0, 1], depth=2) as reader:
+            for path, bands, metadata in reader:
+                ...
+    """
+
+    def __init__(self, paths, datasets, depth=2, workers=None, reader=read_subdatasets):
+        """
+        :param paths: list of paths to the HDF files,
+        :param datasets: list of subdatasets indices read from each file,
+        :param depth: number of files decoded ahead of the consumer,
+        :param workers: number of decoding threads, default is min(depth, 4),
+        :param reader: function (path, datasets, out) -> (bands, metadata), as example read_subdatasets.
+        """
+        if depth < 1:
+            raise ValueError('Prefetch depth must be at least 1')
+        self.paths = list(paths)
+        self.datasets = datasets
+        self.depth = depth
+        self.workers = min(depth, 4) if workers is None else max(1, min(workers, depth))
+        self.reader = reader
+
+        self._free_slots = queue.Queue()
+        for _ in range(depth + 1):
+            self._free_slots.put([None] * len(datasets))
+        self._ready = queue.Queue()
+        self._next_index = 0
+        self._index_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _take_index(self):
+        with self._index_lock:
+            if self._next_index >= len(self.paths):
+                return None
+            index = self._next_index
+            self._next_index = index + 1
+            return index
+
+    def _take_slot(self):
+        # Waiting for the free buffer is interrupted when the consumer stops the reader
+        while not self._stop.is_set():
+            try:
+                return self._free_slots.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _work(self):
+        while not self._stop.is_set():
+            slot = self._take_slot()
+            if slot is None:
+                break
+            index = self._take_index()
+            if index is None:
+                self._free_slots.put(slot)
+                break
+            try:
+                bands, metadata = self.reader(self.paths[index], self.datasets, out=slot)
+            except Exception as e:
+                self._free_slots.put(slot)
+                self._ready.put((index, e, None))
+                break
+            # New arrays allocated by the reader replace buffers of the slot for the next reads
+            slot[:] = bands
+            self._ready.put((index, slot, metadata))
+        self._ready.put(_DONE)
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __iter__(self):
+        """Iterator yields (path, bands, metadata) in the order in which files are decoded. If the iterator started
+        the workers (the reader is not used as the context manager), they are stopped when the iteration ends or the
+        iterator is closed."""
+        started_here = not self._threads
+        if started_here:
+            self.start()
+        finished_workers = 0
+        try:
+            while finished_workers < self.workers:
+                item = self._ready.get()
+                if item is _DONE:
+                    finished_workers = finished_workers + 1
+                    continue
+                index, slot, metadata = item
+                if isinstance(slot, Exception):
+                    self.stop()
+                    raise slot
+                try:
+                    yield self.paths[index], slot, metadata
+                finally:
+                    # Consumer asked for the next file (or stopped), buffers of this file may be reused
+                    self._free_slots.put(slot)
+        finally:
+            if started_here:
+                self.stop()
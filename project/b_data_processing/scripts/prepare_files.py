@@ -2,6 +2,10 @@ import os
 import datetime
 import pandas as pd
 
+LUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'additional_data', 'lut_modis')
+LOOKUP_TABLE_LEAP = os.path.join(LUT_FOLDER, 'julian_day_calendar_leap.csv')
+LOOKUP_TABLE_REGULAR = os.path.join(LUT_FOLDER, 'julian_day_calendar_regular.csv')
+
 
 def _only_chosen(bag_of_files, infile, file_end):
     f_list = []
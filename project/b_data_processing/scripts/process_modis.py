@@ -1,45 +1,98 @@
+import logging
 import os
+from collections import namedtuple
 
-import rasterio as rio
-import rasterio.mask as rmask
+import numpy as np
 
-from osgeo import gdal
+from instrumentation import stage
 
+logger = logging.getLogger(__name__)
 
-def hdf_to_tiff(base_folder_modis, list_of_files, output_folder, datasets):
+# MODIS quality flags as lists of (first bit, number of bits, accepted values).
+# Bits 0-1 of the QC layer (MODLAND QA): 00 - good quality, 01 - produced, check other QA, 10 and 11 - not produced
+QC_FLAGS = {
+    'MOD11': [(0, 2, [0, 1])],  # QC_Day / QC_Night, 8 bits
+    'MOD11_GOOD': [(0, 2, [0])],
+    'MOD13': [(0, 2, [0, 1])],  # VI Quality, 16 bits
+    'MOD13_GOOD': [(0, 2, [0]), (2, 4, [0, 1, 2, 3])]  # and VI usefulness from the highest to decreasing quality
+}
+
+# Products which store scale_factor as the divisor: physical value = (raw value - add_offset) / scale_factor, as
+# example NDVI and EVI of MOD13 with scale_factor 10000. Other products (as example MOD11 LST with scale_factor 0.02)
+# use physical value = raw value * scale_factor + add_offset
+SCALE_DIVISOR_PRODUCTS = ('MOD13', 'MYD13')
+
+# Bands are kept in their native dtype, physical value = raw value * scale + offset
+BandMetadata = namedtuple('BandMetadata', ['dtype', 'scale', 'offset', 'nodata', 'geotransform', 'projection'])
+
+
+def scale_is_divisor(path_to_file):
+    """Function returns True if the MODIS product of the file (read from the file name) stores scale_factor as the
+    divisor, see SCALE_DIVISOR_PRODUCTS"""
+    return os.path.basename(path_to_file).upper().startswith(SCALE_DIVISOR_PRODUCTS)
+
+
+def physical_scale(scale, offset, divisor=False):
+    """
+    Function returns scale and offset of the band in the convention: physical value = raw value * scale + offset.
+    :param scale: scale reported by GDAL (scale_factor of the subdataset) or None,
+    :param offset: offset reported by GDAL (add_offset of the subdataset) or None,
+    :param divisor: True for products from SCALE_DIVISOR_PRODUCTS, only scale factors greater than 1 are treated as
+    divisors, so scales already converted by the reader are not inverted twice,
+    :return: scale, offset
+    """
+    scale = 1.0 if scale is None else scale
+    offset = 0.0 if offset is None else offset
+    if divisor and scale > 1:
+        return 1.0 / scale, -offset / scale
+    return scale, offset
+
+
+def hdf_to_tiff(base_folder_modis, list_of_files, output_folder, datasets, output_type=None):
+    """Function converts subdatasets of the HDF files into GeoTIFFs. Bands are stored in their native dtype with
+    the scale, offset and no data value of the subdataset, unless output_type (as example 'Float32') is given.
+    Scale and offset of products from SCALE_DIVISOR_PRODUCTS are stored as raw value * scale + offset."""
+    from osgeo import gdal
+
+    translate_options = []
+    if output_type is not None:
+        translate_options = ['-ot', output_type]
+    if type(datasets) == int:
+        datasets = [datasets]
 
     for f in list_of_files:
 
         path_to_file = os.path.join(base_folder_modis, f)
-        modis_data = gdal.Open(path_to_file)
-        subdatasets = modis_data.GetSubDatasets()
+        with stage('hdf_decode', file=f) as record:
+            modis_data = gdal.Open(path_to_file)
+            subdatasets = modis_data.GetSubDatasets()
 
-        vals = []
-        output_paths = []
-        if type(datasets) == int:
-            val = subdatasets[datasets][0]
-            vals.append(val)
-            filename = 'mod_' + f[:-4] + str(datasets) + '.tif'
-            output_path = os.path.join(output_folder, filename)
-            output_paths.append(output_path)
-            gdal.Translate(output_path, val, options=gdal.TranslateOptions([b'-ot', b'Float32']))
-        else:
+            output_paths = []
             for ds in datasets:
                 val = subdatasets[ds][0]
-                vals.append(val)
                 filename = 'mod_' + f[:-4] + str(ds) + '.tif'
                 output_path = os.path.join(output_folder, filename)
                 output_paths.append(output_path)
-                gdal.Translate(output_path, val, options=gdal.TranslateOptions([b'-ot', b'Float32']))
+                options = list(translate_options)
+                if scale_is_divisor(f):
+                    band = gdal.Open(val).GetRasterBand(1)
+                    scale, offset = physical_scale(band.GetScale(), band.GetOffset(), divisor=True)
+                    options = options + ['-a_scale', repr(scale), '-a_offset', repr(offset)]
+                gdal.Translate(output_path, val, options=gdal.TranslateOptions(options))
 
-        del modis_data
+            del modis_data
+            record.add_file(read_bytes=os.path.getsize(path_to_file),
+                            written_bytes=sum(os.path.getsize(p) for p in output_paths))
         for p in output_paths:
-            print('File {} processed successfully'.format(p))
+            logger.info('File {} processed successfully'.format(p))
     return output_paths
 
 
 def clip_area(vector_geometry, raster_file, save_image_to):
-    with rio.open(raster_file, 'r') as raster_source:
+    import rasterio as rio
+    import rasterio.mask as rmask
+
+    with stage('clip', raster=raster_file) as record, rio.open(raster_file, 'r') as raster_source:
         try:
             clipped_image, transform = rmask.mask(raster_source, vector_geometry, crop=True)
             metadata = raster_source.meta.copy()
@@ -51,11 +104,114 @@ def clip_area(vector_geometry, raster_file, save_image_to):
                 g_tiff.write(clipped_image)
 
             message = 'STATUS 1: Clipped: {} saved successfully'.format(save_image_to)
+            record.add_file(read_bytes=clipped_image.nbytes, written_bytes=os.path.getsize(save_image_to))
 
         except ValueError:
             message = 'STATUS 0: ' + save_image_to + ' not clipped - wrong geometry'
-            print(message)
-            with open('log.txt', 'a') as the_file:
-                the_file.write(message + '\n')
+            logger.warning(message)
+
+    return message
+
+def _band_metadata(subdataset, band, array, divisor=False):
+    # GDAL reports scale_factor and add_offset of the subdataset as they are stored in the file, products from
+    # SCALE_DIVISOR_PRODUCTS are converted into the convention: physical = raw * scale + offset
+    metadata = subdataset.GetMetadata()
+    scale, offset = physical_scale(band.GetScale(), band.GetOffset(), divisor)
+    nodata = band.GetNoDataValue()
+    if nodata is None and '_FillValue' in metadata:
+        nodata = float(metadata['_FillValue'])
+    return BandMetadata(dtype=array.dtype,
+                        scale=scale,
+                        offset=offset,
+                        nodata=nodata,
+                        geotransform=subdataset.GetGeoTransform(),
+                        projection=subdataset.GetProjection())
+
+
+def read_subdatasets(path_to_file, datasets, out=None):
+    """
+    Function opens HDF file once and reads all requested subdatasets in their native dtype.
+    :param path_to_file: path to the HDF file,
+    :param datasets: index of the subdataset or list of indices,
+    :param out: optional list of preallocated numpy arrays (one for each subdataset), data is read into them if
+    their shape and dtype match the subdataset, otherwise new arrays are allocated,
+    :return: list of numpy arrays in the order of datasets, list of BandMetadata
+    """
+    from osgeo import gdal, gdal_array
+
+    if type(datasets) == int:
+        datasets = [datasets]
+
+    with stage('hdf_decode', file=os.path.basename(path_to_file)) as record:
+        modis_data = gdal.Open(path_to_file)
+        subdatasets = modis_data.GetSubDatasets()
+        divisor = scale_is_divisor(path_to_file)
+        bands = []
+        metadata = []
+        for i, ds in enumerate(datasets):
+            subdataset = gdal.Open(subdatasets[ds][0])
+            band = subdataset.GetRasterBand(1)
+            buffer = None if out is None else out[i]
+            if buffer is not None and buffer.shape == (band.YSize, band.XSize) and \
+                    buffer.dtype == gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType):
+                array = band.ReadAsArray(buf_obj=buffer)
+            else:
+                array = band.ReadAsArray()
+            bands.append(array)
+            metadata.append(_band_metadata(subdataset, band, array, divisor))
+            del subdataset
+        del modis_data
+        record.add_file(read_bytes=os.path.getsize(path_to_file))
+    return bands, metadata
+
+
+def export_composite(band, metadata, output_path):
+    """
+    Function materializes scaled float values of the band and stores them as a Float32 GeoTIFF. Pixels with no data
+    are stored as NaN.
+    :param band: numpy array in the native dtype, no data pixels have metadata.nodata (or 0) value,
+    :param metadata: BandMetadata of the band,
+    :param output_path: path to the GeoTIFF,
+    :return: output_path
+    """
+    import rasterio as rio
+    from rasterio.crs import CRS
+    from rasterio.transform import Affine
+
+    nodata = 0 if metadata.nodata is None else metadata.nodata
+    scaled = band.astype(np.float32)
+    scaled *= np.float32(metadata.scale)
+    scaled += np.float32(metadata.offset)
+    scaled[band == nodata] = np.nan
+
+    crs = CRS.from_wkt(metadata.projection) if metadata.projection else None
+    with stage('export', raster=os.path.basename(output_path)) as record:
+        with rio.open(output_path, 'w', driver='GTiff', height=band.shape[0], width=band.shape[1], count=1,
+                      dtype='float32', crs=crs, transform=Affine.from_gdal(*metadata.geotransform),
+                      nodata=np.nan, compress='deflate', tiled=True) as dst:
+            dst.write(scaled, 1)
+        record.add_file(written_bytes=os.path.getsize(output_path))
+    return output_path
+
+
+def qc_lookup_table(quality_flags, bits=8):
+    """
+    Function precomputes mask of accepted values for every possible value of the QC layer.
+    :param quality_flags: list of (first bit, number of bits, accepted values), as example QC_FLAGS['MOD11'],
+    :param bits: number of bits of the QC layer: 8 for uint8 and 16 for uint16 layers,
+    :return: boolean numpy array with 2 ** bits elements
+    """
+    values = np.arange(2 ** bits, dtype=np.uint32)
+    lookup_table = np.ones(2 ** bits, dtype=bool)
+    for first_bit, number_of_bits, accepted_values in quality_flags:
+        field = (values >> first_bit) & ((1 << number_of_bits) - 1)
+        lookup_table &= np.isin(field, accepted_values)
+    return lookup_table
+
 
-    return message
\ No newline at end of file
+def qc_mask(qc_band, lookup_table):
+    """Function returns boolean mask of pixels which QC value is accepted by the lookup table"""
+    if qc_band.dtype.kind == 'i':
+        # Signed QC layers are reinterpreted bit by bit as unsigned values
+        qc_band = qc_band.view(np.dtype('u{}'.format(qc_band.dtype.itemsize)))
+    return lookup_table[qc_band]
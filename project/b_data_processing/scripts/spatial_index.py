@@ -0,0 +1,166 @@
+import logging
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+
+def pixel_centers(rows, cols, transform):
+    """Function returns x, y coordinates of the centers of the pixels"""
+    xs, ys = transform * (np.asarray(cols) + 0.5, np.asarray(rows) + 0.5)
+    return np.column_stack((xs, ys))
+
+
+def snap_to_cells(coordinates, transform, shape):
+    """
+    Function snaps points to the raster cells and keeps one point per cell.
+    :param coordinates: (n, 2) array of x, y coordinates in the raster CRS,
+    :param transform: affine transform of the raster,
+    :param shape: (rows, cols) of the raster,
+    :return: indices of kept points (the first point in each cell), their rows and cols
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    cols, rows = ~transform * (coordinates[:, 0], coordinates[:, 1])
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    inside_indices = np.flatnonzero(inside)
+    _, first = np.unique(rows[inside] * shape[1] + cols[inside], return_index=True)
+    kept = np.sort(inside_indices[first])
+    return kept, rows[kept], cols[kept]
+
+
+def thin_occurrences(coordinates, distance, transform=None, shape=None, seed=None):
+    """
+    Function snaps occurrences to one record per raster cell (if the raster transform and shape are given) and thins
+    them, so no two records are closer than the distance.
+    :param coordinates: (n, 2) array of x, y coordinates in the raster CRS,
+    :param distance: minimum distance between kept records, 0 disables thinning,
+    :param transform: affine transform of the raster,
+    :param shape: (rows, cols) of the raster,
+    :param seed: random seed of the thinning,
+    :return: sorted indices of kept records
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    indices = np.arange(len(coordinates))
+    if transform is not None:
+        indices, _, _ = snap_to_cells(coordinates, transform, shape)
+    kept = OccurrenceIndex(coordinates[indices]).thin(distance, seed=seed)
+    return indices[kept]
+
+
+class OccurrenceIndex:
+    """Class indexes occurrence points with the KD-tree. Points must be given in a projected CRS (distances in
+    meters or other linear units), as example in the CRS of the raster with environmental variables."""
+
+    def __init__(self, coordinates):
+        """
+        :param coordinates: (n, 2) array of x, y coordinates.
+        """
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.tree = cKDTree(self.coordinates)
+
+    def thin(self, distance, seed=None):
+        """
+        Method thins points, so no two kept points are closer than the distance and each removed point is within the
+        distance of some kept point. Points are visited in random order and a point is kept if none of the points
+        kept before is within the distance.
+
+        In each round points are reduced to one point per grid cell of size distance / sqrt(2) (all points in such
+        cell are closer than the distance), so neighborhoods of the remaining points are small even in dense clusters
+        and thinning is O(n log n). Points left uncovered by the kept points are thinned again in the next round.
+        :param distance: minimum distance between kept points,
+        :param seed: random seed of the visiting order,
+        :return: sorted indices of kept points
+        """
+        rng = np.random.default_rng(seed)
+        number_of_points = len(self.coordinates)
+        if number_of_points == 0 or distance <= 0:
+            return np.arange(number_of_points)
+
+        cell_size = distance / np.sqrt(2)
+        remaining = rng.permutation(number_of_points)
+        kept = []
+        while len(remaining):
+            # One random representative of each grid cell
+            cells = np.floor(self.coordinates[remaining] / cell_size).astype(np.int64)
+            _, first = np.unique(cells, axis=0, return_index=True)
+            candidates = remaining[np.sort(first)]
+            selected = candidates[self._greedy(self.coordinates[candidates], distance)]
+            kept.append(selected)
+
+            # Points of the cells whose representatives were removed may be farther than the distance from kept points
+            distances, _ = cKDTree(self.coordinates[selected]).query(
+                self.coordinates[remaining], k=1, distance_upper_bound=distance)
+            remaining = remaining[distances > distance]
+        return np.sort(np.concatenate(kept))
+
+    @staticmethod
+    def _greedy(coordinates, distance):
+        # Greedy selection over the graph of neighbors closer than the distance, neighbors are stored as CSR
+        pairs = cKDTree(coordinates).query_pairs(distance, output_type='ndarray')
+        neighbors = np.concatenate((pairs, pairs[:, ::-1]))
+        neighbors = neighbors[np.argsort(neighbors[:, 0], kind='stable')]
+        pointers = np.searchsorted(neighbors[:, 0], np.arange(len(coordinates) + 1))
+
+        removed = np.zeros(len(coordinates), dtype=bool)
+        kept = []
+        for i in range(len(coordinates)):
+            if removed[i]:
+                continue
+            kept.append(i)
+            removed[neighbors[pointers[i]:pointers[i + 1], 1]] = True
+        return np.array(kept, dtype=np.int64)
+
+    def distance_to_nearest(self, points, upper_bound=np.inf):
+        """Method returns distances from the points to the nearest indexed point, distances greater than the
+        upper_bound are returned as infinity"""
+        if len(self.coordinates) == 0:
+            return np.full(len(points), np.inf)
+        distances, _ = self.tree.query(np.asarray(points, dtype=np.float64), k=1, distance_upper_bound=upper_bound)
+        return distances
+
+    def sample_background(self, valid_pixels, transform, number_of_points, buffer_distance=0, seed=None,
+                          max_iterations=100):
+        """
+        Method draws background (pseudo-absence) points from the valid pixels of the raster. Each pixel is drawn
+        at most once and pixels closer to the indexed presences than the buffer_distance are excluded.
+        :param valid_pixels: boolean array, True for pixels which may be drawn,
+        :param transform: affine transform of the raster,
+        :param number_of_points: number of points to draw,
+        :param buffer_distance: radius of the exclusion buffer around presences,
+        :param seed: random seed,
+        :param max_iterations: maximum number of drawing rounds, fewer points are returned (and the warning is
+        logged) if the valid area outside the buffers is too small,
+        :return: rows and cols of the drawn pixels
+        """
+        rng = np.random.default_rng(seed)
+        shape = valid_pixels.shape
+        # Candidates are drawn only from valid pixels, so the share of the study area in the raster extent does not
+        # matter (as example the country clipped from the MODIS tile)
+        valid_indices = np.flatnonzero(valid_pixels)
+        drawn = np.empty(0, dtype=np.int64)
+
+        for _ in range(max_iterations):
+            missing = number_of_points - len(drawn)
+            if missing <= 0 or len(drawn) == len(valid_indices):
+                break
+            # Oversampling compensates pixels rejected as buffered or already drawn, small areas are checked whole
+            sample_size = min(missing * 4 + 16, len(valid_indices))
+            candidates = np.sort(valid_indices[rng.choice(len(valid_indices), sample_size, replace=False)])
+            if buffer_distance > 0 and len(candidates):
+                rows, cols = np.divmod(candidates, shape[1])
+                distances = self.distance_to_nearest(pixel_centers(rows, cols, transform), buffer_distance)
+                candidates = candidates[distances > buffer_distance]
+            candidates = np.setdiff1d(candidates, drawn, assume_unique=True)
+            drawn = np.concatenate((drawn, rng.permutation(candidates)[:missing]))
+            if sample_size == len(valid_indices):
+                # All valid pixels were checked, other rounds cannot add new points
+                break
+
+        if len(drawn) < number_of_points:
+            logger.warning('Only {} of {} background points were drawn, there are not enough valid pixels outside '
+                           'the buffers of presences'.format(len(drawn), number_of_points))
+        rows, cols = np.divmod(drawn, shape[1])
+        return rows, cols
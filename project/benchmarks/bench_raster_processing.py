@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_data
+from benchmarks.synthetic_data import TILES
+
+# Grouping methods of ModisProcessing which are implemented, the rest of methods are placeholders
+GROUPINGS = ['all', 'by_season_all']
+
+
+def test_create_modis_dataframe(benchmark, memory_profile, years):
+    from b_data_processing.scripts.prepare_files import create_modis_dataframe
+    from b_data_processing.scripts.prepare_files import LOOKUP_TABLE_LEAP as leap
+    from b_data_processing.scripts.prepare_files import LOOKUP_TABLE_REGULAR as regular
+
+    names = synthetic_data.modis_filenames(years, TILES)
+
+    memory_profile(create_modis_dataframe, names, leap, regular, TILES)
+    df = benchmark(create_modis_dataframe, names, leap, regular, TILES)
+    assert len(df) == len(names)
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+@pytest.mark.parametrize('grouping_method', GROUPINGS)
+def test_create_time_series(benchmark, memory_profile, modis_folder, years, grouping_method, prefetch):
+    from b_data_processing.process_raster_data import ModisProcessing
+
+    def create_time_series():
+        mp = ModisProcessing(prefetch=prefetch)
+        return mp.create_time_series(input_directory=modis_folder, grouping_method=grouping_method,
+                                     years_limit=years, tiles_type=TILES)
+
+    memory_profile(create_time_series)
+    merged_tiles = benchmark.pedantic(create_time_series, rounds=3, iterations=1)
+    assert len(merged_tiles) == len(TILES)
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_create_time_series_all_groupings(benchmark, memory_profile, modis_folder, years, cached):
+    from b_data_processing.process_raster_data import ModisProcessing
+    from b_data_processing.scripts.band_cache import BandCache
+
+    def create_time_series():
+        # Each grouping method reads the same files, with the cache they are decoded only once
+        band_cache = BandCache(max_bytes=1024 ** 3) if cached else None
+        return [ModisProcessing(band_cache=band_cache).create_time_series(
+            input_directory=modis_folder, grouping_method=grouping_method, years_limit=years, tiles_type=TILES)
+            for grouping_method in GROUPINGS]
+
+    memory_profile(create_time_series)
+    results = benchmark.pedantic(create_time_series, rounds=3, iterations=1)
+    assert len(results) == len(GROUPINGS)
+
+
+def test_hdf_to_tiff(benchmark, memory_profile, modis_folder, tmp_path):
+    from b_data_processing.scripts.process_modis import hdf_to_tiff
+
+    files = sorted(f for f in os.listdir(modis_folder) if f.endswith('.hdf'))[:12]
+    subdatasets = list(range(len(synthetic_data.MOD11B3_SUBDATASETS)))
+
+    memory_profile(hdf_to_tiff, modis_folder, files, str(tmp_path), subdatasets)
+    output_paths = benchmark(hdf_to_tiff, modis_folder, files, str(tmp_path), subdatasets)
+    assert all(os.path.exists(p) for p in output_paths)
+
+
+def test_read_mod13_subdatasets(benchmark, mod13_folder):
+    from b_data_processing.scripts.process_modis import read_subdatasets
+
+    path = os.path.join(mod13_folder, sorted(os.listdir(mod13_folder))[0])
+    bands, metadata = benchmark(read_subdatasets, path, [0, 1])
+    for band, band_metadata in zip(bands, metadata):
+        # scale_factor 10000 of NDVI and EVI is the divisor, physical values are in the range of the index
+        assert band_metadata.scale == pytest.approx(1e-4)
+        valid = band[band != band_metadata.nodata]
+        assert np.abs(valid * band_metadata.scale + band_metadata.offset).max() <= 1.5
+
+
+def test_clip_area(benchmark, memory_profile, geotiff_file, tmp_path):
+    import rasterio as rio
+    from b_data_processing.scripts.process_modis import clip_area
+
+    with rio.open(geotiff_file) as src:
+        geometry = synthetic_data.synthetic_study_area(src.bounds)
+    output = str(tmp_path / 'clipped.tif')
+
+    memory_profile(clip_area, geometry, geotiff_file, output)
+    message = benchmark(clip_area, geometry, geotiff_file, output)
+    assert message.startswith('STATUS 1')
+
+
+@pytest.mark.parametrize('ratio', [10, 100])
+def test_random_subset(benchmark, memory_profile, geotiff_file, ratio):
+    from b_data_processing.scripts.generate_random_points import RandomSubset
+
+    def sample():
+        subset = RandomSubset(geotiff_file)
+        subset.get_random_coordinates(ratio=ratio)
+        return subset.get_values()
+
+    memory_profile(sample)
+    points = benchmark(sample)
+    assert np.all(np.array(points)[:, 2] > 0)
+
+
+@pytest.mark.parametrize('number_of_points', [10000, 100000])
+def test_thin_occurrences(benchmark, memory_profile, number_of_points):
+    from b_data_processing.scripts.spatial_index import OccurrenceIndex
+
+    bounds = (0, 0, 1000000, 1000000)
+    points = synthetic_data.synthetic_occurrences(number_of_points, bounds)
+
+    def thin():
+        return OccurrenceIndex(points).thin(5000, seed=0)
+
+    memory_profile(thin)
+    kept = benchmark(thin)
+    assert 0 < len(kept) < number_of_points
+
+
+def test_background_points(benchmark, memory_profile, geotiff_file):
+    from b_data_processing.scripts.generate_random_points import RandomSubset
+
+    subset = RandomSubset(geotiff_file)
+    left, top = subset.transformation_matrix * (0, 0)
+    right, bottom = subset.transformation_matrix * (subset.band.shape[1], subset.band.shape[0])
+    presences = synthetic_data.synthetic_occurrences(10000, (left, bottom, right, top))
+
+    def sample():
+        subset.get_background_coordinates(presences, 10000, buffer_distance=abs(subset.transformation_matrix.a) * 5,
+                                          seed=0)
+        return list(subset.iter_values())
+
+    memory_profile(sample)
+    batches = benchmark(sample)
+    assert all(np.all(batch['value'] > 0) for batch in batches)
+
+
+@pytest.mark.parametrize('dtype, flags', [('uint8', 'MOD11'), ('uint16', 'MOD13_GOOD')])
+def test_qc_mask(benchmark, raster_shape, dtype, flags):
+    from b_data_processing.scripts.process_modis import QC_FLAGS, qc_lookup_table, qc_mask
+
+    qc_band = synthetic_data.synthetic_band((raster_shape[0] * 10, raster_shape[1] * 10), dtype)
+    lookup_table = qc_lookup_table(QC_FLAGS[flags], bits=np.dtype(dtype).itemsize * 8)
+    mask = benchmark(qc_mask, qc_band, lookup_table)
+    assert mask.shape == qc_band.shape
+
+
+def test_aggregate_era5_months(benchmark, years):
+    from b_data_processing.process_climate_data import aggregate_by_month, month_index
+
+    # One year of hourly ERA5 over a country-sized 0.25 degree grid
+    hours = np.arange('{}-01-01T00'.format(years[0]), '{}-01-01T00'.format(years[0] + 1), dtype='datetime64[h]')
+    fields = np.random.default_rng(0).normal(280, 5, (len(hours), 40, 60)).astype(np.float32)
+    month_ids, sums, counts = benchmark(aggregate_by_month, fields, month_index(hours))
+    assert len(month_ids) == 12 and counts.sum() == fields.size
+
+
+def test_resample_era5_to_modis(benchmark, raster_shape):
+    pytest.importorskip('pyproj')
+    from b_data_processing.process_climate_data import bilinear_weights, resample
+    from benchmarks.synthetic_data import SINUSOIDAL_CRS, tile_geotransform
+
+    shape = (raster_shape[0] * 4, raster_shape[1] * 4)
+    latitudes = np.arange(72, 34.9, -0.25)
+    longitudes = np.arange(-25, 45.1, 0.25)
+    weights = bilinear_weights(latitudes, longitudes, tile_geotransform(TILES[0], shape), shape, SINUSOIDAL_CRS)
+    fields = np.random.default_rng(0).normal(280, 5, (12, len(latitudes), len(longitudes)))
+    resampled = benchmark(resample, fields, weights, shape)
+    assert resampled.shape == (12,) + shape
@@ -0,0 +1,89 @@
+"""Benchmark fixtures
+Benchmarks use pytest-benchmark and run fully offline on synthetic data, see synthetic_data.py.
+
+Run from the project folder:
+    python -m pytest benchmarks --benchmark-autosave
+and compare with the previous runs (results are stored in .benchmarks/ together with the commit id):
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+
+Size of the synthetic datasets is controlled with the --raster-size and --years options.
+"""
+
+import os
+import resource
+import sys
+import tracemalloc
+
+import pytest
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_FOLDER not in sys.path:
+    sys.path.insert(0, PROJECT_FOLDER)
+
+from benchmarks import synthetic_data  # noqa: E402
+from benchmarks.synthetic_data import TILES  # noqa: E402
+from instrumentation import Instrumentation  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption('--raster-size', type=int, default=240,
+                     help='number of rows and columns of synthetic rasters')
+    parser.addoption('--years', type=int, default=2,
+                     help='number of years in the synthetic MODIS time series')
+
+
+@pytest.fixture(scope='session')
+def raster_shape(request):
+    size = request.config.getoption('--raster-size')
+    return size, size
+
+
+@pytest.fixture(scope='session')
+def years(request):
+    return range(2001, 2001 + request.config.getoption('--years'))
+
+
+@pytest.fixture(scope='session')
+def modis_folder(tmp_path_factory, raster_shape, years):
+    pytest.importorskip('osgeo.gdal')
+    folder = str(tmp_path_factory.mktemp('modis'))
+    synthetic_data.write_synthetic_hdf_series(folder, years, TILES, shape=raster_shape)
+    return folder
+
+
+@pytest.fixture(scope='session')
+def mod13_folder(tmp_path_factory, raster_shape, years):
+    # MOD13C2 series with NDVI and EVI stored with scale_factor 10000 (divisor)
+    pytest.importorskip('osgeo.gdal')
+    folder = str(tmp_path_factory.mktemp('mod13'))
+    synthetic_data.write_synthetic_hdf_series(folder, years[:1], TILES[:1], shape=raster_shape, product='MOD13C2')
+    return folder
+
+
+@pytest.fixture(scope='session')
+def geotiff_file(tmp_path_factory, raster_shape):
+    pytest.importorskip('rasterio')
+    path = os.path.join(str(tmp_path_factory.mktemp('geotiff')), 'band.tif')
+    return synthetic_data.write_synthetic_geotiff(path, shape=(raster_shape[0] * 4, raster_shape[1] * 4))
+
+
+@pytest.fixture
+def memory_profile(benchmark):
+    """Fixture runs function once under tracemalloc and stores peak of the Python heap (numpy arrays included), peak
+    RSS sampled during the run and peak RSS of the whole process in the benchmark extra info."""
+
+    def profile(function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            with Instrumentation(log_level=None).stage('benchmark') as record:
+                result = function(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_traced_memory_bytes'] = peak
+        benchmark.extra_info['peak_rss_bytes'] = record.peak_rss
+        benchmark.extra_info['peak_rss_scope'] = record.peak_rss_scope
+        benchmark.extra_info['process_peak_rss_kilobytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return result
+
+    return profile
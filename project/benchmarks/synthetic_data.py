@@ -0,0 +1,177 @@
+"""Synthetic datasets for benchmarks
+Scripts in this module generate offline fixtures which mimic the inputs of the raster processing part:
+a) MODIS file names (product, acquisition date, tile, version, production date),
+b) HDF-like files with many subdatasets (netCDF-4 / HDF5 containers written by GDAL),
+c) single band GeoTIFF rasters,
+d) species occurrence points and study area polygons.
+
+All generators take a seed, so the same benchmark run always works on the same data.
+"""
+
+import datetime
+import os
+
+import numpy as np
+
+SINUSOIDAL_CRS = '+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +R=6371007.181 +units=m +no_defs'
+MODIS_TILE_SIZE = 1111950.5197665233  # Size of the MODIS sinusoidal tile in meters
+TILES = ['h18v03', 'h18v04']
+
+# Subdatasets of the MOD11B3 product: name, dtype, scale factor, fill value
+MOD11B3_SUBDATASETS = [
+    ('LST_Day_6km', 'uint16', 0.02, 0),
+    ('QC_Day', 'uint8', 1.0, 0),
+    ('LST_Night_6km', 'uint16', 0.02, 0),
+    ('QC_Night', 'uint8', 1.0, 0)
+]
+
+# Subdatasets of the MOD13C2 product, scale factor 10000 is the divisor of NDVI and EVI
+MOD13C2_SUBDATASETS = [
+    ('CMG_0.05_Deg_Monthly_NDVI', 'int16', 10000.0, -3000),
+    ('CMG_0.05_Deg_Monthly_EVI', 'int16', 10000.0, -3000),
+    ('CMG_0.05_Deg_Monthly_VI_Quality', 'uint16', 1.0, 65535)
+]
+
+PRODUCT_SUBDATASETS = {'MOD11B3': MOD11B3_SUBDATASETS, 'MOD13C2': MOD13C2_SUBDATASETS}
+
+
+def modis_filename(acquisition_date, tile='h18v03', product='MOD11B3', version='006'):
+    """Function returns MODIS file name, as example: MOD11B3.A2001032.h18v03.006.2016006151003.hdf"""
+    julian_day = acquisition_date.timetuple().tm_yday
+    return '{}.A{}{:03d}.{}.{}.2016006151003.hdf'.format(product, acquisition_date.year, julian_day, tile, version)
+
+
+def modis_filenames(years, tiles, product='MOD11B3'):
+    """Function returns monthly MODIS file names for all given years and tiles"""
+    names = []
+    for year in years:
+        for month in range(1, 13):
+            for tile in tiles:
+                names.append(modis_filename(datetime.date(year, month, 1), tile, product))
+    return names
+
+
+def tile_geotransform(tile, shape):
+    """Function returns GDAL geotransform of the MODIS sinusoidal tile (tile='h18v03') divided into (rows, cols)"""
+    horizontal = int(tile[1:3])
+    vertical = int(tile[4:6])
+    left = (horizontal - 18) * MODIS_TILE_SIZE
+    top = (9 - vertical) * MODIS_TILE_SIZE
+    return left, MODIS_TILE_SIZE / shape[1], 0.0, top, 0.0, -MODIS_TILE_SIZE / shape[0]
+
+
+def synthetic_band(shape, dtype='uint16', fill_ratio=0.1, fill_value=0, seed=0):
+    """Function returns smooth random band with a given ratio of no data pixels"""
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(0, 4 * np.pi, shape[0])[:, np.newaxis]
+    cols = np.linspace(0, 4 * np.pi, shape[1])[np.newaxis, :]
+    info = np.iinfo(dtype) if np.issubdtype(np.dtype(dtype), np.integer) else None
+    if info is not None:
+        low, high = max(info.min, 1), min(info.max, 15000)
+    else:
+        low, high = 0.0, 1.0
+    band = (np.sin(rows) * np.cos(cols) + 1) / 2 * (high - low) + low
+    band = band + rng.normal(0, (high - low) * 0.01, shape)
+    band = np.clip(band, low, high).astype(dtype)
+    band[rng.random(shape) < fill_ratio] = fill_value
+    return band
+
+
+def write_synthetic_hdf(path, shape=(240, 240), subdatasets=MOD11B3_SUBDATASETS, tile='h18v03', seed=0):
+    """
+    Function writes HDF-like file with many subdatasets. The file is a netCDF-4 (HDF5) container, GDAL exposes its
+    variables with GetSubDatasets() exactly as the subdatasets of MODIS HDF4 files.
+    :param path: output path, MODIS-like file name is recommended,
+    :param shape: (rows, cols) of each subdataset,
+    :param subdatasets: list of (name, dtype, scale factor, fill value),
+    :param tile: MODIS tile used for the georeference,
+    :param seed: random seed,
+    :return: path
+    """
+    from osgeo import gdal, gdal_array, osr
+
+    driver = gdal.GetDriverByName('netCDF')
+    ds = driver.CreateMultiDimensional(path)
+    root = ds.GetRootGroup()
+    dim_y = root.CreateDimension('YDim', None, None, shape[0])
+    dim_x = root.CreateDimension('XDim', None, None, shape[1])
+
+    # Coordinate variables give the subdatasets the georeference of the MODIS tile
+    left, x_size, _, top, _, y_size = tile_geotransform(tile, shape)
+    float64 = gdal.ExtendedDataType.Create(gdal.GDT_Float64)
+    x_coordinates = root.CreateMDArray('XDim', [dim_x], float64)
+    x_coordinates.Write(left + (np.arange(shape[1]) + 0.5) * x_size)
+    dim_x.SetIndexingVariable(x_coordinates)
+    y_coordinates = root.CreateMDArray('YDim', [dim_y], float64)
+    y_coordinates.Write(top + (np.arange(shape[0]) + 0.5) * y_size)
+    dim_y.SetIndexingVariable(y_coordinates)
+    srs = osr.SpatialReference()
+    srs.ImportFromProj4(SINUSOIDAL_CRS)
+
+    for i, (name, dtype, scale, fill_value) in enumerate(subdatasets):
+        gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(dtype))
+        array = root.CreateMDArray(name, [dim_y, dim_x], gdal.ExtendedDataType.Create(gdal_type))
+        array.SetSpatialRef(srs)
+        array.SetNoDataValueDouble(fill_value)
+        array.SetScale(scale)
+        array.SetOffset(0.0)
+        array.Write(synthetic_band(shape, dtype, fill_value=fill_value, seed=seed + i))
+    del ds
+    return path
+
+
+def write_synthetic_hdf_series(folder, years, tiles, shape=(240, 240), product='MOD11B3', seed=0):
+    """Function writes monthly series of synthetic HDF files and returns list of file names"""
+    names = modis_filenames(years, tiles, product)
+    for i, name in enumerate(names):
+        tile = name.split('.')[2]
+        write_synthetic_hdf(os.path.join(folder, name), shape=shape, subdatasets=PRODUCT_SUBDATASETS[product],
+                            tile=tile, seed=seed + i)
+    return names
+
+
+def write_synthetic_geotiff(path, shape=(1000, 1000), dtype='float32', tile='h18v03', nodata=0, seed=0):
+    """Function writes single band GeoTIFF in the MODIS sinusoidal projection and returns path"""
+    import rasterio as rio
+    from rasterio.transform import Affine
+
+    transform = Affine.from_gdal(*tile_geotransform(tile, shape))
+    band = synthetic_band(shape, dtype, fill_value=nodata, seed=seed)
+    with rio.open(path, 'w', driver='GTiff', height=shape[0], width=shape[1], count=1, dtype=dtype,
+                  crs=SINUSOIDAL_CRS, transform=transform, nodata=nodata, tiled=True) as dst:
+        dst.write(band, 1)
+    return path
+
+
+def synthetic_occurrences(number_of_points, bounds, clusters=20, spread=0.02, seed=0):
+    """
+    Function returns clustered occurrence points, like GBIF records, as (n, 2) array of x, y coordinates.
+    :param number_of_points: number of points,
+    :param bounds: (left, bottom, right, top) of the area,
+    :param clusters: number of clusters,
+    :param spread: standard deviation of points around the cluster center as a fraction of the area width,
+    :param seed: random seed.
+    """
+    rng = np.random.default_rng(seed)
+    left, bottom, right, top = bounds
+    centers = np.column_stack((rng.uniform(left, right, clusters), rng.uniform(bottom, top, clusters)))
+    assignment = rng.integers(0, clusters, number_of_points)
+    points = centers[assignment] + rng.normal(0, spread * (right - left), (number_of_points, 2))
+    points[:, 0] = np.clip(points[:, 0], left, right)
+    points[:, 1] = np.clip(points[:, 1], bottom, top)
+    return points
+
+
+def synthetic_study_area(bounds, vertices=32, seed=0):
+    """Function returns list with a single GeoJSON-like polygon inside the bounds, ready for rasterio.mask"""
+    rng = np.random.default_rng(seed)
+    left, bottom, right, top = bounds
+    center_x = (left + right) / 2
+    center_y = (bottom + top) / 2
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radius = rng.uniform(0.3, 0.45, vertices)
+    xs = center_x + np.cos(angles) * radius * (right - left)
+    ys = center_y + np.sin(angles) * radius * (top - bottom)
+    ring = [(float(x), float(y)) for x, y in zip(xs, ys)]
+    ring.append(ring[0])
+    return [{'type': 'Polygon', 'coordinates': [ring]}]
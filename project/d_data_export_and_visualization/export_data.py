@@ -0,0 +1,236 @@
+"""Data Export functions
+Scripts in this module export point tables produced by the project: point features sampled from rasters, species
+occurrences and per-point predictions.
+Module processes:
+a) batches of points given as pandas DataFrames or dictionaries of numpy arrays,
+b) GBIF occurrence downloads (Darwin Core Archive or simple CSV zip files),
+and writes them into:
+a) partitioned Parquet datasets,
+b) GeoPackage point layers.
+
+Data is written batch by batch, the whole table is never materialized in memory. Columns are stored with compact
+dtypes: floating point features are written as float32 (coordinates stay float64) and text columns are
+dictionary-encoded.
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pa_ds
+
+COORDINATE_COLUMNS = ('x', 'y', 'decimalLongitude', 'decimalLatitude')
+OCCURRENCE_COLUMNS = ['gbifID', 'species', 'countryCode', 'decimalLongitude', 'decimalLatitude', 'eventDate', 'year',
+                      'month', 'coordinateUncertaintyInMeters']
+
+# Types of the occurrence columns are declared, so columns without values in the first chunk (as example eventDate)
+# get the same type in all chunks
+OCCURRENCE_DTYPES = {'gbifID': 'Int64', 'species': str, 'countryCode': str, 'decimalLongitude': 'float64',
+                     'decimalLatitude': 'float64', 'eventDate': str, 'year': 'Int16', 'month': 'Int8',
+                     'coordinateUncertaintyInMeters': 'float64'}
+OCCURRENCE_TYPES = {'gbifID': pa.int64(), 'species': pa.dictionary(pa.int32(), pa.string()),
+                    'countryCode': pa.dictionary(pa.int32(), pa.string()), 'decimalLongitude': pa.float64(),
+                    'decimalLatitude': pa.float64(), 'eventDate': pa.string(), 'year': pa.int16(), 'month': pa.int8(),
+                    'coordinateUncertaintyInMeters': pa.float32()}
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       BATCH SOURCES                                                              ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def iter_occurrences(gbif_archive, batch_size=100000, columns=None):
+    """
+    Function reads GBIF occurrence download in chunks. Both Darwin Core Archive (occurrence.txt) and simple CSV
+    downloads are supported.
+    :param gbif_archive: path to the zip file downloaded from GBIF,
+    :param batch_size: number of records per batch,
+    :param columns: list of columns to read, default are OCCURRENCE_COLUMNS present in the file,
+    :return: generator of pandas DataFrames
+    """
+    if columns is None:
+        columns = OCCURRENCE_COLUMNS
+    with zipfile.ZipFile(gbif_archive) as archive:
+        members = archive.namelist()
+        if 'occurrence.txt' in members:
+            table = 'occurrence.txt'
+        else:
+            table = [m for m in members if m.endswith('.csv')][0]
+        with archive.open(table) as occurrences:
+            chunks = pd.read_csv(occurrences, sep='\t', usecols=lambda c: c in columns, chunksize=batch_size,
+                                 quoting=3, low_memory=False, dtype=OCCURRENCE_DTYPES)
+            for chunk in chunks:
+                yield chunk
+
+
+def _to_dataframe(batch):
+    if isinstance(batch, pd.DataFrame):
+        return batch
+    return pd.DataFrame(batch)
+
+
+def _compact_type(column, dtype, dtypes):
+    if column in dtypes:
+        return dtypes[column]
+    if pa.types.is_floating(dtype) and column not in COORDINATE_COLUMNS:
+        return pa.float32()
+    # Object columns without values in the first batch have the null type, they are promoted to text
+    if pa.types.is_string(dtype) or pa.types.is_large_string(dtype) or pa.types.is_null(dtype):
+        return pa.dictionary(pa.int32(), pa.string())
+    return dtype
+
+
+def compact_schema(batch, dtypes=None):
+    """
+    Function derives schema with compact dtypes from the first batch of data. Types of columns which may be empty in
+    the first batch should be given in dtypes, columns without any value are stored as text.
+    :param batch: pandas DataFrame or dictionary of numpy arrays,
+    :param dtypes: dictionary {column name: pyarrow type} which overrides derived types,
+    :return: pyarrow Schema
+    """
+    if dtypes is None:
+        dtypes = {}
+    schema = pa.Schema.from_pandas(_to_dataframe(batch), preserve_index=False)
+    fields = [pa.field(f.name, _compact_type(f.name, f.type, dtypes)) for f in schema]
+    return pa.schema(fields)
+
+
+def _chain_first(first_batch, batches):
+    yield first_batch
+    for batch in batches:
+        yield batch
+
+
+def _record_batches(batches, schema):
+    # Batches are cast with safe=True, so values which do not fit in the compact dtype raise an error
+    for batch in batches:
+        yield pa.RecordBatch.from_pandas(_to_dataframe(batch), schema=schema, preserve_index=False)
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       EXPORT                                                                     ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def export_to_parquet(batches, output_folder, partition_by=None, dtypes=None, compression='zstd',
+                      max_rows_per_file=5000000, existing_data='replace'):
+    """
+    Function writes stream of batches into the (hive) partitioned Parquet dataset.
+    :param batches: iterable of pandas DataFrames or dictionaries of numpy arrays with the same columns,
+    :param output_folder: dataset root folder,
+    :param partition_by: list of columns used for partitioning, as example: ['year', 'month'],
+    :param dtypes: dictionary {column name: pyarrow type} which overrides compact types, OCCURRENCE_TYPES are used
+    for the GBIF occurrence columns by default,
+    :param compression: parquet compression codec,
+    :param max_rows_per_file: maximum number of rows in a single parquet file,
+    :param existing_data: 'replace' - dataset is written into the temporary folder which replaces the output_folder
+    when the export is finished, no files of the previous export are left, 'partitions' - only partitions present in
+    the batches are replaced, other partitions of the previous export are kept (requires partition_by),
+    :return: schema of the written dataset or None if there were no batches.
+    """
+    if existing_data not in ('replace', 'partitions'):
+        raise KeyError('Existing data behavior {} is not supported, use replace or partitions'.format(existing_data))
+    if existing_data == 'partitions' and not partition_by:
+        raise ValueError('Partitions of the existing data may be replaced only in the partitioned dataset')
+
+    batches = iter(batches)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return None
+
+    types = dict(OCCURRENCE_TYPES)
+    types.update(dtypes or {})
+    schema = compact_schema(first_batch, types)
+    partitioning = None
+    if partition_by:
+        partitioning = pa_ds.partitioning(pa.schema([schema.field(c) for c in partition_by]), flavor='hive')
+
+    file_options = pa_ds.ParquetFileFormat().make_write_options(compression=compression)
+    write_options = dict(schema=schema, format='parquet', partitioning=partitioning, file_options=file_options,
+                         max_rows_per_file=max_rows_per_file, max_rows_per_group=min(max_rows_per_file, 1000000))
+    record_batches = _record_batches(_chain_first(first_batch, batches), schema)
+
+    if existing_data == 'partitions':
+        pa_ds.write_dataset(record_batches, output_folder, existing_data_behavior='delete_matching', **write_options)
+        return schema
+
+    # Readers never see the mix of the old and the new files, the previous dataset is removed after the swap
+    output_folder = os.path.abspath(output_folder)
+    parent_folder = os.path.dirname(output_folder)
+    os.makedirs(parent_folder, exist_ok=True)
+    temporary_folder = tempfile.mkdtemp(prefix='.{}.'.format(os.path.basename(output_folder)), dir=parent_folder)
+    try:
+        pa_ds.write_dataset(record_batches, temporary_folder, existing_data_behavior='overwrite_or_ignore',
+                            **write_options)
+    except BaseException:
+        shutil.rmtree(temporary_folder, ignore_errors=True)
+        raise
+    previous_folder = None
+    if os.path.exists(output_folder):
+        previous_folder = temporary_folder + '.previous'
+        os.rename(output_folder, previous_folder)
+    os.rename(temporary_folder, output_folder)
+    if previous_folder is not None:
+        shutil.rmtree(previous_folder)
+    return schema
+
+
+def _fiona_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'int'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'str'
+
+
+def export_to_geopackage(batches, output_file, crs, x='x', y='y', layer='points'):
+    """
+    Function writes stream of batches into the GeoPackage point layer.
+    :param batches: iterable of pandas DataFrames or dictionaries of numpy arrays with the same columns,
+    :param output_file: path to the .gpkg file,
+    :param crs: coordinate reference system of the points, as example: 'EPSG:4326',
+    :param x: name of the column with x coordinates,
+    :param y: name of the column with y coordinates,
+    :param layer: layer name,
+    :return: number of written features.
+    """
+    import fiona
+    from fiona.crs import CRS
+
+    batches = iter(batches)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return 0
+
+    first_batch = _to_dataframe(first_batch)
+    attributes = [c for c in first_batch.columns if c not in (x, y)]
+    schema = {'geometry': 'Point',
+              'properties': {c: _fiona_type(first_batch[c].dtype) for c in attributes}}
+
+    written = 0
+    with fiona.open(output_file, 'w', driver='GPKG', layer=layer, crs=CRS.from_user_input(crs),
+                    schema=schema) as gpkg:
+        for batch in _chain_first(first_batch, batches):
+            df = _to_dataframe(batch)
+            records = df[attributes].astype(object).where(df[attributes].notna(), None).to_dict('records')
+            xs = df[x].to_numpy(dtype=np.float64)
+            ys = df[y].to_numpy(dtype=np.float64)
+            gpkg.writerecords(
+                {'geometry': {'type': 'Point', 'coordinates': (px, py)}, 'properties': properties}
+                for px, py, properties in zip(xs, ys, records)
+            )
+            written = written + len(df)
+    return written
+
+
+if __name__ == '__main__':
+    occurrences = iter_occurrences('../e_sample_data/0004777-190307172214381.zip')
+    export_to_parquet(occurrences, 'occurrences_parquet', partition_by=['countryCode'])
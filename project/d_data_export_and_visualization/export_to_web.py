@@ -0,0 +1,282 @@
+"""Web Tiles Export
+Scripts in this module publish raster outputs (suitability maps, MODIS composites, DEM derivatives) as web tiles.
+Module processes:
+a) single band rasters in any format readable by rasterio,
+b) tile pyramids stored in the XYZ layout: output_folder/z/x/y.png (or .webp).
+
+Tiles are rendered in the Web Mercator projection (EPSG:3857) with the GoogleMapsCompatible tile matrix, so the same
+folder may be served as an XYZ layer or as a WMTS layer with the GoogleMapsCompatible tile matrix set.
+
+Each rendered tile is identified by the hash of its data and of the style used to render it. Hashes are stored in the
+tiles manifest inside the output folder and the next run re-renders only tiles which content has changed. Tiles
+without any valid pixel are not written at all.
+
+The value range (vmin, vmax) mapped to the colormap is a part of the style. It is stored in the manifest and reused
+by the next runs, so changed pixels do not change the style of the whole pyramid (the warning is logged if values of
+the raster are outside the stored range). Changing the range (or the colormap, format or resampling) invalidates
+every tile, tiles of the previous image format are removed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+WEB_MERCATOR = 'EPSG:3857'
+ORIGIN_SHIFT = 20037508.342789244  # Half of the Web Mercator world extent in meters
+TILE_SIZE = 256
+MANIFEST_FILE = 'tiles_manifest.json'
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = {
+    'png': ('PNG', {'optimize': True}),
+    'webp': ('WEBP', {'lossless': True})
+}
+
+
+def tile_bounds(x, y, zoom):
+    """Function returns bounds of the XYZ tile in the Web Mercator coordinates: (left, bottom, right, top)"""
+    tile_extent = 2 * ORIGIN_SHIFT / (2 ** zoom)
+    left = -ORIGIN_SHIFT + x * tile_extent
+    top = ORIGIN_SHIFT - y * tile_extent
+    return left, top - tile_extent, left + tile_extent, top
+
+
+def tiles_covering(bounds, zoom):
+    """Function returns list of (x, y) tiles at a given zoom level covering bounds in the Web Mercator coordinates"""
+    number_of_tiles = 2 ** zoom
+    tile_extent = 2 * ORIGIN_SHIFT / number_of_tiles
+    left, bottom, right, top = bounds
+    x_min = int(np.clip(np.floor((left + ORIGIN_SHIFT) / tile_extent), 0, number_of_tiles - 1))
+    x_max = int(np.clip(np.ceil((right + ORIGIN_SHIFT) / tile_extent) - 1, 0, number_of_tiles - 1))
+    y_min = int(np.clip(np.floor((ORIGIN_SHIFT - top) / tile_extent), 0, number_of_tiles - 1))
+    y_max = int(np.clip(np.ceil((ORIGIN_SHIFT - bottom) / tile_extent) - 1, 0, number_of_tiles - 1))
+    return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def colormap_lut(colormap='magma'):
+    """Function returns (256, 4) RGBA lookup table of uint8 values for a given matplotlib colormap"""
+    import matplotlib
+    cmap = matplotlib.colormaps[colormap]
+    return cmap(np.linspace(0, 1, 256), bytes=True)
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       TILE RENDERING (WORKER PROCESSES)                                          ###
+###                                                                                                                  ###
+########################################################################################################################
+
+_worker_state = {}
+
+
+def _init_worker(raster_file, nodata, resampling, lut, vmin, vmax, image_format):
+    # Each worker keeps its own handle to the source raster for the whole run
+    _worker_state['source'] = rio.open(raster_file, 'r')
+    _worker_state['nodata'] = nodata
+    _worker_state['resampling'] = resampling
+    _worker_state['lut'] = lut
+    _worker_state['vmin'] = vmin
+    _worker_state['vmax'] = vmax
+    _worker_state['image_format'] = image_format
+    style = '{}|{}|{}|{}'.format(vmin, vmax, image_format, resampling.name).encode()
+    _worker_state['style'] = lut.tobytes() + style
+
+
+def _read_tile(x, y, zoom):
+    src = _worker_state['source']
+    nodata = _worker_state['nodata']
+    left, bottom, right, top = tile_bounds(x, y, zoom)
+    tile_transform = from_bounds(left, bottom, right, top, TILE_SIZE, TILE_SIZE)
+    with WarpedVRT(src, crs=WEB_MERCATOR, transform=tile_transform, width=TILE_SIZE, height=TILE_SIZE,
+                   resampling=_worker_state['resampling'], src_nodata=nodata, nodata=nodata) as vrt:
+        data = vrt.read(1)
+    valid = (data != nodata) & np.isfinite(data)
+    return data, valid
+
+
+def _colorize(data, valid):
+    vmin = _worker_state['vmin']
+    vmax = _worker_state['vmax']
+    scaled = (data.astype(np.float64) - vmin) / (vmax - vmin)
+    scaled = np.clip(np.nan_to_num(scaled), 0, 1)
+    rgba = _worker_state['lut'][(scaled * 255).astype(np.uint8)]
+    rgba[~valid, 3] = 0
+    return rgba
+
+
+def _render_tile(task):
+    """Worker renders a single tile and returns (tile key, status, content hash)"""
+    zoom, x, y, previous_hash, output_path = task
+    key = '{}/{}/{}'.format(zoom, x, y)
+
+    data, valid = _read_tile(x, y, zoom)
+    if not valid.any():
+        return key, 'empty', None
+
+    hasher = hashlib.sha256(_worker_state['style'])
+    hasher.update(np.ascontiguousarray(data).tobytes())
+    hasher.update(np.packbits(valid).tobytes())
+    content_hash = hasher.hexdigest()
+
+    if content_hash == previous_hash and os.path.exists(output_path):
+        return key, 'reused', content_hash
+
+    from PIL import Image
+    image_format, save_options = IMAGE_FORMATS[_worker_state['image_format']]
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    Image.fromarray(_colorize(data, valid), 'RGBA').save(output_path, format=image_format, **save_options)
+    return key, 'rendered', content_hash
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       TILE PYRAMID                                                               ###
+###                                                                                                                  ###
+########################################################################################################################
+
+class TilePyramid:
+    """Class renders XYZ tile pyramid from a single band raster. Tiles from all zoom levels are rendered in parallel
+    by a pool of processes, tiles without data are skipped and tiles which content did not change since the last run
+    are reused."""
+
+    def __init__(self, raster_file, output_folder, min_zoom=0, max_zoom=8, colormap='magma', image_format='png',
+                 vmin=None, vmax=None, nodata=None, resampling=Resampling.bilinear, workers=None):
+        """
+        :param raster_file: path to the single band raster,
+        :param output_folder: folder where tiles are stored in the z/x/y layout,
+        :param min_zoom: the lowest zoom level of the pyramid,
+        :param max_zoom: the highest zoom level of the pyramid,
+        :param colormap: name of the matplotlib colormap, default is magma,
+        :param image_format: 'png' or 'webp',
+        :param vmin: value mapped to the lowest color, if None then the value stored in the manifest of the previous
+        run is used, or the minimum of the raster for the new pyramid,
+        :param vmax: value mapped to the highest color, if None then the value stored in the manifest of the previous
+        run is used, or the maximum of the raster for the new pyramid. For suitability maps pass vmin=0 and vmax=1.
+        Changing vmin or vmax re-renders every tile,
+        :param nodata: value which is treated as no data, if None then raster nodata value is used and if the raster
+        has no nodata value then 0 is treated as no data,
+        :param resampling: rasterio Resampling method used for the reprojection into the tiles,
+        :param workers: number of processes, if None then number of CPUs is used.
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise KeyError('Image format {} is not supported, use one of: {}'.format(
+                image_format, ', '.join(IMAGE_FORMATS)))
+        self.raster_file = raster_file
+        self.output_folder = output_folder
+        self.zoom_levels = range(min_zoom, max_zoom + 1)
+        self.colormap = colormap
+        self.image_format = image_format
+        self.resampling = resampling
+        self.workers = workers
+        self.manifest_path = os.path.join(output_folder, MANIFEST_FILE)
+
+        with rio.open(raster_file, 'r') as src:
+            if nodata is None:
+                nodata = src.nodata if src.nodata is not None else 0
+            self.bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+            stored_range = self._load_manifest().get('value_range')
+            if vmin is None or vmax is None:
+                band_min, band_max = self._value_range(src, nodata)
+                if stored_range is not None:
+                    self._check_stored_range(stored_range, band_min, band_max, vmin is None, vmax is None)
+                    vmin = stored_range[0] if vmin is None else vmin
+                    vmax = stored_range[1] if vmax is None else vmax
+                vmin = band_min if vmin is None else vmin
+                vmax = band_max if vmax is None else vmax
+        if vmax <= vmin:
+            vmax = vmin + 1
+        self.nodata = nodata
+        self.vmin = vmin
+        self.vmax = vmax
+
+    @staticmethod
+    def _value_range(src, nodata, max_pixels=4096 * 4096):
+        # Value range is estimated from the decimated read to keep memory low for national-scale rasters
+        decimation = max(1, int(np.ceil(np.sqrt(src.width * src.height / max_pixels))))
+        out_shape = (max(1, src.height // decimation), max(1, src.width // decimation))
+        band = src.read(1, out_shape=out_shape, resampling=Resampling.nearest)
+        valid = band[(band != nodata) & np.isfinite(band)]
+        if valid.size == 0:
+            return 0, 1
+        return float(valid.min()), float(valid.max())
+
+    def _check_stored_range(self, stored_range, band_min, band_max, reuse_min, reuse_max):
+        # Values outside the reused range are clipped to the colors of the range limits
+        if (reuse_min and band_min < stored_range[0]) or (reuse_max and band_max > stored_range[1]):
+            logger.warning('Values of {} from {} to {} are outside the value range [{}, {}] stored by the previous '
+                           'run, they are clipped to the colormap limits. Pass vmin and vmax to change the range '
+                           '(every tile is rendered again)'.format(self.raster_file, band_min, band_max, *stored_range))
+
+    def _load_manifest(self):
+        # Manifest: {'value_range': [vmin, vmax], 'image_format': format, 'tiles': {'z/x/y': hash}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as manifest:
+                return json.load(manifest)
+        return {}
+
+    def _save_manifest(self, tiles):
+        os.makedirs(self.output_folder, exist_ok=True)
+        temporary_path = self.manifest_path + '.tmp'
+        manifest = {'value_range': [self.vmin, self.vmax], 'image_format': self.image_format, 'tiles': tiles}
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, sort_keys=True)
+        os.replace(temporary_path, self.manifest_path)
+
+    def tile_path(self, zoom, x, y, image_format=None):
+        if image_format is None:
+            image_format = self.image_format
+        return os.path.join(self.output_folder, str(zoom), str(x), '{}.{}'.format(y, image_format))
+
+    def _tasks(self, manifest):
+        for zoom in self.zoom_levels:
+            for x, y in tiles_covering(self.bounds, zoom):
+                key = '{}/{}/{}'.format(zoom, x, y)
+                yield zoom, x, y, manifest.get(key), self.tile_path(zoom, x, y)
+
+    def build(self):
+        """
+        Method renders the pyramid and updates the tiles manifest.
+        :return summary: dictionary with number of rendered, reused, empty and removed tiles.
+        """
+        previous = self._load_manifest()
+        previous_manifest = previous.get('tiles', {})
+        previous_format = previous.get('image_format', self.image_format)
+        manifest = {}
+        summary = {'rendered': 0, 'reused': 0, 'empty': 0, 'removed': 0}
+
+        initargs = (self.raster_file, self.nodata, self.resampling, colormap_lut(self.colormap),
+                    self.vmin, self.vmax, self.image_format)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs) as pool:
+            for key, status, content_hash in pool.map(_render_tile, self._tasks(previous_manifest), chunksize=64):
+                summary[status] += 1
+                if content_hash is not None:
+                    manifest[key] = content_hash
+
+        # Tiles from the previous run which are empty or out of the pyramid now, all of them if the format changed
+        stale_keys = set(previous_manifest)
+        if previous_format == self.image_format:
+            stale_keys = stale_keys - set(manifest)
+        for key in stale_keys:
+            zoom, x, y = key.split('/')
+            stale_tile = self.tile_path(zoom, x, y, previous_format)
+            if os.path.exists(stale_tile):
+                os.remove(stale_tile)
+                summary['removed'] += 1
+
+        self._save_manifest(manifest)
+        return summary
+
+
+if __name__ == '__main__':
+    pyramid = TilePyramid('suitability_map.tif', 'tiles', min_zoom=4, max_zoom=10)
+    print(pyramid.build())
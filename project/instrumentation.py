@@ -0,0 +1,266 @@
+"""Pipeline Instrumentation
+Scripts in this module measure the stages of the pipeline: download, HDF decode, composite, mosaic, clip, sample,
+predict and export.
+For each run of a stage the StageRecord is created with:
+a) wall time,
+b) RSS of the process at the end of the stage and peak RSS of the process during the stage (on Linux RSS is sampled
+by the background thread while stages run, so peaks shorter than the sampling interval may be missed, on other
+systems peak_rss is the peak of the whole process lifetime and peak_rss_scope is 'process'). Counters of the
+process (VmHWM, ru_maxrss) are never reset, so other tools reading them are not affected,
+c) bytes read and written and number of processed files, reported by the stage itself, and bytes read and written
+by the process (from /proc/self/io, Linux only),
+d) optional profile: cProfile statistics or tracemalloc peak of the Python heap.
+
+Records are passed to the metrics callbacks and logged as JSON by the 'sdm.metrics' logger. Library code reports its
+work with the module-level stage() context manager, the pipeline owner configures what happens with records:
+
+    import instrumentation
+    instrumentation.configure(callbacks=[my_callback], profile='tracemalloc')
+
+    with instrumentation.stage('clip', raster=path) as record:
+        ...
+        record.add_file(read_bytes=os.path.getsize(path))
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+STAGES = ('download', 'hdf_decode', 'composite', 'mosaic', 'clip', 'sample', 'predict', 'export')
+
+logger = logging.getLogger('sdm.metrics')
+
+
+def _process_io():
+    # Bytes read and written by the process, /proc/self/io exists only on Linux
+    try:
+        with open('/proc/self/io', 'r') as proc_io:
+            counters = dict(line.split(': ') for line in proc_io.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _current_rss():
+    # Current RSS in bytes, /proc/self/statm exists only on Linux
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class StageRecord:
+    """Class stores metrics of a single run of the pipeline stage"""
+
+    def __init__(self, stage, **tags):
+        self.stage = stage
+        self.tags = tags
+        self.wall_time = None
+        self.rss = None
+        self.peak_rss = None
+        self.peak_rss_scope = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.files_processed = 0
+        self.process_bytes_read = None
+        self.process_bytes_written = None
+        self.profile = None
+        self.error = None
+
+    def add_file(self, read_bytes=0, written_bytes=0):
+        """Method counts processed file with bytes read from it and written after its processing"""
+        self.files_processed = self.files_processed + 1
+        self.bytes_read = self.bytes_read + read_bytes
+        self.bytes_written = self.bytes_written + written_bytes
+
+    def as_dict(self):
+        return {
+            'stage': self.stage,
+            'tags': self.tags,
+            'wall_time': self.wall_time,
+            'rss': self.rss,
+            'peak_rss': self.peak_rss,
+            'peak_rss_scope': self.peak_rss_scope,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'files_processed': self.files_processed,
+            'process_bytes_read': self.process_bytes_read,
+            'process_bytes_written': self.process_bytes_written,
+            'profile': self.profile,
+            'error': self.error
+        }
+
+    def __str__(self):
+        return json.dumps(self.as_dict(), default=str)
+
+
+class Instrumentation:
+    """Class creates StageRecords and passes them into the callbacks and the log"""
+
+    def __init__(self, callbacks=None, log_level=logging.INFO, profile=None, profile_stages=None,
+                 profile_folder=None, rss_interval=0.01):
+        """
+        :param callbacks: list of functions called with each finished StageRecord,
+        :param log_level: level of the 'sdm.metrics' log records, None disables logging,
+        :param profile: None, 'cprofile' or 'tracemalloc',
+        :param profile_stages: list of stages which are profiled, if None then all stages are profiled,
+        :param profile_folder: if given then cProfile statistics are dumped there as <stage>_<timestamp>.prof files,
+        :param rss_interval: interval in seconds of RSS sampling while stages run.
+        """
+        if profile not in (None, 'cprofile', 'tracemalloc'):
+            raise KeyError('Profile {} is not supported, use cprofile or tracemalloc'.format(profile))
+        self.callbacks = list(callbacks) if callbacks else []
+        self.log_level = log_level
+        self.profile = profile
+        self.profile_stages = profile_stages
+        self.profile_folder = profile_folder
+        self._profile_lock = threading.Lock()
+        self.rss_interval = rss_interval
+        self._rss_lock = threading.Lock()
+        self._active_peaks = {}
+        self._sampler_stop = None
+
+    def _should_profile(self, stage_name):
+        if self.profile is None:
+            return False
+        return self.profile_stages is None or stage_name in self.profile_stages
+
+    @contextmanager
+    def _profiled(self, record):
+        # Only one profiler of each kind may be active in the process, nested and concurrent stages are not profiled
+        if not self._should_profile(record.stage) or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            if self.profile == 'cprofile':
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    record.profile = self._cprofile_summary(record, profiler)
+            else:
+                started_tracing = not tracemalloc.is_tracing()
+                if started_tracing:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+                try:
+                    yield
+                finally:
+                    _, peak = tracemalloc.get_traced_memory()
+                    if started_tracing:
+                        tracemalloc.stop()
+                    record.profile = {'tracemalloc_peak': peak}
+        finally:
+            self._profile_lock.release()
+
+    def _cprofile_summary(self, record, profiler):
+        summary = {}
+        if self.profile_folder is not None:
+            os.makedirs(self.profile_folder, exist_ok=True)
+            path = os.path.join(self.profile_folder, '{}_{}.prof'.format(record.stage, int(time.time() * 1000)))
+            profiler.dump_stats(path)
+            summary['path'] = path
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(10)
+        summary['top'] = stream.getvalue()
+        return summary
+
+    def _sample_rss(self, stop):
+        # One sampler thread updates peaks of all running (nested or concurrent) stages
+        while not stop.wait(self.rss_interval):
+            rss = _current_rss()
+            with self._rss_lock:
+                for active_record in self._active_peaks:
+                    self._active_peaks[active_record] = max(self._active_peaks[active_record], rss)
+
+    def _start_peak(self, record):
+        rss = _current_rss()
+        if rss is None:
+            return False
+        with self._rss_lock:
+            self._active_peaks[record] = rss
+            if self._sampler_stop is None:
+                self._sampler_stop = threading.Event()
+                threading.Thread(target=self._sample_rss, args=(self._sampler_stop,), name='sdm-rss-sampler',
+                                 daemon=True).start()
+        return True
+
+    def _finish_peak(self, record, stage_scope):
+        if not stage_scope:
+            record.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            record.peak_rss_scope = 'process'
+            return
+        rss = _current_rss() or 0
+        with self._rss_lock:
+            record.peak_rss = max(self._active_peaks.pop(record), rss)
+            record.peak_rss_scope = 'stage'
+            if not self._active_peaks:
+                # Sampler stops when no stage is running
+                self._sampler_stop.set()
+                self._sampler_stop = None
+
+    @contextmanager
+    def stage(self, stage_name, **tags):
+        """
+        Context manager which measures the block of code as a run of the stage.
+        :param stage_name: stage name, usually one of STAGES,
+        :param tags: additional information stored with the record, as example: file name or tile,
+        :return record: StageRecord which may be updated by the stage (files, bytes).
+        """
+        record = StageRecord(stage_name, **tags)
+        read_start, written_start = _process_io()
+        stage_scope = self._start_peak(record)
+        start = time.perf_counter()
+        try:
+            with self._profiled(record):
+                yield record
+        except Exception as e:
+            record.error = repr(e)
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - start
+            read_end, written_end = _process_io()
+            if read_start is not None and read_end is not None:
+                record.process_bytes_read = read_end - read_start
+                record.process_bytes_written = written_end - written_start
+            record.rss = _current_rss()
+            self._finish_peak(record, stage_scope)
+            self.emit(record)
+
+    def emit(self, record):
+        if self.log_level is not None:
+            logger.log(self.log_level, str(record))
+        for callback in self.callbacks:
+            callback(record)
+
+
+_instrumentation = Instrumentation()
+
+
+def configure(callbacks=None, log_level=logging.INFO, profile=None, profile_stages=None, profile_folder=None,
+              rss_interval=0.01):
+    """Function replaces instrumentation used by all stages of the pipeline, parameters are described in the
+    Instrumentation class."""
+    global _instrumentation
+    _instrumentation = Instrumentation(callbacks, log_level, profile, profile_stages, profile_folder, rss_interval)
+    return _instrumentation
+
+
+def get_instrumentation():
+    return _instrumentation
+
+
+def stage(stage_name, **tags):
+    """Context manager which measures the block of code with the instrumentation configured for the pipeline"""
+    return _instrumentation.stage(stage_name, **tags)
@@ -1,10 +1,82 @@
-from a_data_preparation.get_eo_data import ModisRequest
+"""Species Distribution Modeling - command line entry point
+Commands import only the subsystem they need, so offline commands do not load GDAL or the API clients of the
+data providers:
+a) run: non-interactive run of the pipelines described in the config files, see pipeline.py,
+b) modis-download: interactive download of MODIS datasets (pymodis),
+c) modis-catalog: table of MODIS files in a folder with their tiles and acquisition dates (pandas only).
 
+Usage:
+    python main.py run ixodes_ricinus.toml dermacentor_reticulatus.toml --workers 4
+    python main.py modis-download --output-folder sample_data
+    python main.py modis-catalog ixodes_data/modis --tiles h18v03 h18v04 --output catalog.csv
 
-if __name__ == '__main__':
+Interactive downloaders of other datasets are started from the project folder as modules:
+    python -m a_data_preparation.get_climate_datasets
+    python -m a_data_preparation.get_dem_data
+    python -m a_data_preparation.get_eo_data
+    python -m a_data_preparation.get_species_data
+"""
+
+import argparse
+import logging
+
+
+def run(args):
+    from pipeline import Pipeline
+
+    for config_file in args.config_files:
+        status = Pipeline(config_file, cache_folder=args.cache_folder, workers=args.workers).run(args.targets)
+        logging.info('Pipeline {} finished: {}'.format(config_file, status))
 
-    # Prepare MODIS data
 
-    mr = ModisRequest(interactive=True, output_folder='sample_data')
+def modis_download(args):
+    from a_data_preparation.get_eo_data import ModisRequest
+
+    mr = ModisRequest(interactive=True, output_folder=args.output_folder)
     mr.prepare_requests()
     mr.get_modis_data()
+
+
+def modis_catalog(args):
+    from b_data_processing.scripts.prepare_files import get_filelist, create_modis_dataframe
+    from b_data_processing.scripts.prepare_files import LOOKUP_TABLE_LEAP, LOOKUP_TABLE_REGULAR
+
+    files = get_filelist(args.input_folder, args.tiles, '.hdf')
+    catalog = create_modis_dataframe(files, LOOKUP_TABLE_LEAP, LOOKUP_TABLE_REGULAR, args.tiles)
+    if args.output is None:
+        print(catalog.to_string(index=False))
+    else:
+        catalog.to_csv(args.output, index=False)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Species Distribution Modeling pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = commands.add_parser('run', help='run pipelines described in the config files')
+    pipeline.add_argument('config_files', nargs='+', help='.toml or .yaml pipeline descriptions')
+    pipeline.add_argument('--targets', nargs='+', default=None, help='stages to run with their upstream stages')
+    pipeline.add_argument('--cache-folder', default=None)
+    pipeline.add_argument('--workers', type=int, default=None)
+    pipeline.set_defaults(function=run)
+
+    download = commands.add_parser('modis-download', help='interactive download of MODIS datasets')
+    download.add_argument('--output-folder', default='sample_data')
+    download.set_defaults(function=modis_download)
+
+    catalog = commands.add_parser('modis-catalog', help='catalog of MODIS files stored in the folder')
+    catalog.add_argument('input_folder')
+    catalog.add_argument('--tiles', nargs='+', default=['h18v03', 'h18v04', 'h19v03', 'h19v04'])
+    catalog.add_argument('--output', default=None, help='csv file, if not given catalog is printed')
+    catalog.set_defaults(function=modis_catalog)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    # Stage metrics are logged by the 'sdm.metrics' logger, see instrumentation.py
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    arguments = parse_arguments()
+    arguments.function(arguments)
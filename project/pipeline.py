@@ -0,0 +1,442 @@
+"""Pipeline Runner
+Scripts in this module run the whole project without interactive prompts. The pipeline is described in a TOML or
+YAML file as a graph of stages (download -> decode -> composite -> extract -> fit -> predict -> export):
+
+    [pipeline]
+    cache_folder = '.pipeline_cache'
+    workers = 4
+
+    [stages.lst]
+    task = 'modis_download'
+    params = {product = 1, tiles = 'h18v03,h18v04', start_date = '2018-01-01', end_date = '2018-12-31',
+              output_folder = 'modis', username_env = 'LPDAAC_USER', password_env = 'LPDAAC_PASSWORD'}
+
+    [stages.composite]
+    task = 'modis_composite'
+    depends_on = ['lst']
+    params = {input_directory = '@lst', grouping_method = 'by_season_all', years = [2018, 2018],
+              tiles = ['h18v03', 'h18v04']}
+
+    [stages.model]
+    task = 'my_package.models:fit'
+    depends_on = ['composite']
+    params = {bands = '@composite', output_file = 'model.pickle'}
+
+Stages which do not depend on each other run concurrently. Parameter value '@name' is replaced with the result of
+the stage 'name' and '@name.key' with the value of the key from the dictionary returned by the stage. Task is a name
+from the TASKS dictionary or a path to any function in the form 'module:function', the function is called with the
+resolved params as keyword arguments.
+
+Each stage result is cached under the key computed from the task, its params, the cache keys of the upstream
+stages and the fingerprints (size, modification time) of files and folders given in the params. Params which names
+start with 'output' point to the results of the stage and params which names start with 'cache' point to the working
+caches (as example cache_directory of decoded bands), they are not fingerprinted. Stage with the unchanged key is
+not run again, its result is read from the cache, unless files returned by the stage were changed or removed after
+the run. Stage which did not write files or folders given in its output params fails and it is not cached.
+
+Custom tasks must follow the same rule: params with files or folders written by the task must have names which start
+with 'output' (as example output_file in the model stage above). Files written into a param with the other name
+(as example path) change its fingerprint, so the stage gets a new cache key on every run and it is never cached.
+"""
+
+import graphlib
+import hashlib
+import importlib
+import json
+import logging
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       BUILT-IN TASKS                                                             ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def _credential(params, name):
+    # Credentials are given directly or, preferably, as the name of the environment variable
+    if params.get(name) is not None:
+        return params[name]
+    variable = params.get(name + '_env')
+    if variable is None:
+        return None
+    if variable not in os.environ:
+        raise KeyError('Environment variable {} with the {} is not set'.format(variable, name))
+    return os.environ[variable]
+
+
+def modis_download(product, tiles, start_date, end_date, output_folder, **credentials):
+    from a_data_preparation.get_eo_data import ModisRequest
+
+    username = _credential(credentials, 'username')
+    password = _credential(credentials, 'password')
+    if username is None or password is None:
+        raise KeyError('MODIS download requires username and password (or username_env and password_env)')
+    os.makedirs(output_folder, exist_ok=True)
+    mr = ModisRequest(interactive=False)
+    mr.prepare_requests(username=username, password=password,
+                        input_information=[product, tiles, start_date, end_date, output_folder])
+    mr.get_modis_data()
+    return output_folder
+
+
+def climate_download(variable, years, months, hours, output_file, days=None):
+    from a_data_preparation.get_climate_datasets import DataRequest, download_climate_data
+
+    if days is None:
+        days = [str(x) for x in range(1, 32)]
+    request = DataRequest(interactive=False).prepare_requests(
+        input_information=[variable, [str(y) for y in years], [str(m) for m in months], days, hours, output_file])
+    download_climate_data(request)
+    return output_file
+
+
+def dem_download(bounds, output_file, crs=None, srtm_model=1):
+    """Task downloads SRTM for the bounds (left, bottom, right, top), given in the crs or as geodetic coordinates
+    if crs is None"""
+    from a_data_preparation.get_dem_data import DEMRequest
+
+    DEMRequest(interactive=False, output_folder=output_file, bounds=bounds, crs=crs).download_area(srtm_model)
+    return output_file
+
+
+def species_download(species, country, output_folder='', **credentials):
+    from a_data_preparation.get_species_data import SpeciesRequest
+
+    user = _credential(credentials, 'user')
+    password = _credential(credentials, 'password')
+    email = _credential(credentials, 'email')
+    if user is None or password is None:
+        raise KeyError('GBIF download requires user and password (or user_env and password_env)')
+    sr = SpeciesRequest(interactive=False, output_folder=output_folder, species_name=species,
+                        country_of_occurence=country)
+    return sr.download_area(user=user, password=password, email=email)
+
+
+def _band_cache(cache_bytes, cache_directory):
+    # Stages which run in the same process share one cache of decoded bands, cache_directory (as example in
+    # /dev/shm) shares bands also with the other processes
+    if not cache_bytes:
+        return None
+    from b_data_processing.scripts.band_cache import shared_cache
+
+    return shared_cache(cache_bytes, cache_directory)
+
+
+def modis_composite(input_directory, tiles, years, grouping_method='all', months=(1, 12), subdatasets=(0,),
+                    qc_subdataset=None, qc_flags=None, output_directory='', cache_bytes=0, cache_directory=None):
+    from b_data_processing.process_raster_data import ModisProcessing
+    from b_data_processing.scripts.process_modis import QC_FLAGS
+
+    if isinstance(qc_flags, str):
+        qc_flags = QC_FLAGS[qc_flags]
+    mp = ModisProcessing(subdatasets=list(subdatasets), qc_subdataset=qc_subdataset, qc_flags=qc_flags,
+                         band_cache=_band_cache(cache_bytes, cache_directory))
+    return mp.create_time_series(input_directory=input_directory, output_directory=output_directory,
+                                 grouping_method=grouping_method, years_limit=range(years[0], years[1] + 1),
+                                 months_limit=range(months[0], months[1] + 1), tiles_type=tiles)
+
+
+def modis_mosaic(input_directory, tiles, years, output_directory, grouping_method='all', months=(1, 12),
+                 subdatasets=(0,), qc_subdataset=None, qc_flags=None, destination_crs=None, resolution=None,
+                 resampling='near', materialize=False, cache_bytes=0, cache_directory=None):
+    """Task exports per-tile composites and returns {'<group name>_<subdataset>': path to the mosaic}"""
+    from b_data_processing.process_raster_data import ModisProcessing
+    from b_data_processing.scripts.process_modis import QC_FLAGS
+
+    if isinstance(qc_flags, str):
+        qc_flags = QC_FLAGS[qc_flags]
+    mp = ModisProcessing(subdatasets=list(subdatasets), qc_subdataset=qc_subdataset, qc_flags=qc_flags,
+                         band_cache=_band_cache(cache_bytes, cache_directory))
+    mp.create_time_series(input_directory=input_directory, output_directory=output_directory,
+                          grouping_method=grouping_method, years_limit=range(years[0], years[1] + 1),
+                          months_limit=range(months[0], months[1] + 1), tiles_type=tiles)
+    mosaics = mp.mosaic_composites(destination_crs, resolution, resampling, materialize)
+    return {'{}_{}'.format(group_name, subdataset): path for (group_name, subdataset), path in mosaics.items()}
+
+
+def climate_alignment(netcdf_file, reference_raster, output_directory, grouping_method='all', years=None,
+                      months=(1, 12), variable=None, cache_weights=None):
+    """Task aggregates ERA5 data into the groups of the modis_composite task, resamples them to the grid of the
+    reference raster (as example composite or mosaic of MODIS) and returns {group name: path to the GeoTIFF}.
+    Resampling weights are stored in the cache_weights .npz file and reused by the next runs."""
+    import rasterio as rio
+    from b_data_processing.process_climate_data import ClimateProcessing
+
+    with rio.open(reference_raster) as reference:
+        geotransform = reference.transform.to_gdal()
+        shape = reference.shape
+        projection = reference.crs.to_wkt()
+    cp = ClimateProcessing(netcdf_file, variable=variable)
+    cp.set_destination_grid(geotransform, shape, projection, weights_file=cache_weights)
+    years_limit = None if years is None else range(years[0], years[1] + 1)
+    cp.create_time_series(grouping_method=grouping_method, years_limit=years_limit,
+                          months_limit=range(months[0], months[1] + 1), output_directory=output_directory)
+    return cp.exported_files
+
+
+def clip(vector_file, raster_file, output_file):
+    import fiona
+    from b_data_processing.scripts.process_modis import clip_area
+
+    with fiona.open(vector_file) as features:
+        geometries = [feature['geometry'] for feature in features]
+    message = clip_area(geometries, raster_file, output_file)
+    if message.startswith('STATUS 0'):
+        raise ValueError(message)
+    return output_file
+
+
+def sample(raster_file, ratio=10, cache_bytes=0, cache_directory=None):
+    from b_data_processing.scripts.generate_random_points import RandomSubset
+
+    subset = RandomSubset(raster_file, band_cache=_band_cache(cache_bytes, cache_directory))
+    subset.get_random_coordinates(ratio=ratio)
+    return subset.get_values()
+
+
+def export_parquet(points, output_folder, columns=('x', 'y', 'value'), partition_by=None):
+    import pandas as pd
+    from d_data_export_and_visualization.export_data import export_to_parquet
+
+    export_to_parquet([pd.DataFrame(points, columns=list(columns))], output_folder, partition_by=partition_by)
+    return output_folder
+
+
+def export_tiles(raster_file, output_folder, min_zoom=0, max_zoom=8, colormap='magma', image_format='png'):
+    from d_data_export_and_visualization.export_to_web import TilePyramid
+
+    pyramid = TilePyramid(raster_file, output_folder, min_zoom=min_zoom, max_zoom=max_zoom, colormap=colormap,
+                          image_format=image_format)
+    pyramid.build()
+    return output_folder
+
+
+TASKS = {
+    'modis_download': modis_download,
+    'climate_download': climate_download,
+    'dem_download': dem_download,
+    'species_download': species_download,
+    'modis_composite': modis_composite,
+    'modis_mosaic': modis_mosaic,
+    'climate_alignment': climate_alignment,
+    'clip': clip,
+    'sample': sample,
+    'export_parquet': export_parquet,
+    'export_tiles': export_tiles
+}
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       CONFIGURATION AND CACHE                                                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+def load_config(config_file):
+    """Function reads pipeline description from the .toml, .yaml or .yml file"""
+    if config_file.endswith('.toml'):
+        import tomllib
+        with open(config_file, 'rb') as f:
+            return tomllib.load(f)
+    elif config_file.endswith(('.yaml', '.yml')):
+        import yaml
+        with open(config_file, 'r') as f:
+            return yaml.safe_load(f)
+    raise ValueError('Config file {} must be a .toml, .yaml or .yml file'.format(config_file))
+
+
+def _resolve_task(task):
+    if task in TASKS:
+        return TASKS[task]
+    if ':' not in task:
+        raise KeyError('Task {} is not a built-in task ({}) nor a module:function path'.format(
+            task, ', '.join(TASKS)))
+    module_name, function_name = task.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _fingerprint(value):
+    # Files and folders are identified by their size and modification time, folders by all files inside
+    if not isinstance(value, str) or not os.path.exists(value):
+        return None
+    if os.path.isfile(value):
+        stat = os.stat(value)
+        return [stat.st_size, stat.st_mtime_ns]
+    entries = []
+    for root, _, files in os.walk(value):
+        for f in sorted(files):
+            stat = os.stat(os.path.join(root, f))
+            entries.append([os.path.relpath(os.path.join(root, f), value), stat.st_size, stat.st_mtime_ns])
+    return sorted(entries)
+
+
+def _references(value):
+    # Names of the upstream stages used in params as '@name'
+    if isinstance(value, str) and value.startswith('@'):
+        return {value[1:].split('.')[0]}
+    if isinstance(value, dict):
+        return set().union(*[_references(v) for v in value.values()])
+    if isinstance(value, (list, tuple)):
+        return set().union(*[_references(v) for v in value])
+    return set()
+
+
+def _substitute(value, results):
+    if isinstance(value, str) and value.startswith('@'):
+        name, _, key = value[1:].partition('.')
+        if key:
+            return results[name][key]
+        return results[name]
+    if isinstance(value, dict):
+        return {k: _substitute(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_substitute(v, results) for v in value]
+    return value
+
+
+def _missing_outputs(params):
+    # Files and folders which the stage should have written into its output params
+    return sorted(v for k, v in params.items() if k.startswith('output') and isinstance(v, str) and v and
+                  not os.path.exists(v))
+
+
+def _fingerprints(value):
+    if isinstance(value, dict):
+        return {k: _fingerprints(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_fingerprints(v) for v in value]
+    return _fingerprint(value)
+
+
+########################################################################################################################
+###                                                                                                                  ###
+###                                       PIPELINE                                                                   ###
+###                                                                                                                  ###
+########################################################################################################################
+
+class Pipeline:
+    """Class runs stages of the pipeline in the order given by their dependencies. Independent stages run in
+    parallel threads, stages which inputs did not change are read from the cache."""
+
+    def __init__(self, config, cache_folder=None, workers=None):
+        """
+        :param config: dictionary with the pipeline description or path to the .toml/.yaml file,
+        :param cache_folder: folder with cached results, overrides cache_folder from the config,
+        :param workers: number of parallel stages, overrides workers from the config.
+        """
+        if isinstance(config, str):
+            config = load_config(config)
+        settings = config.get('pipeline', {})
+        self.stages = config['stages']
+        self.cache_folder = cache_folder or settings.get('cache_folder', '.pipeline_cache')
+        self.workers = workers or settings.get('workers', 4)
+        self.results = {}
+        self.keys = {}
+        self.status = {}
+        self.graph = self._build_graph()
+
+    def _build_graph(self):
+        graph = {}
+        for name, stage_config in self.stages.items():
+            dependencies = set(stage_config.get('depends_on', [])) | _references(stage_config.get('params', {}))
+            unknown = dependencies - set(self.stages)
+            if unknown:
+                raise KeyError('Stage {} depends on unknown stages: {}'.format(name, ', '.join(sorted(unknown))))
+            graph[name] = dependencies
+        # Raises graphlib.CycleError if stages depend on each other
+        graphlib.TopologicalSorter(graph).prepare()
+        return graph
+
+    def _cache_key(self, name, params):
+        stage_config = self.stages[name]
+        description = {
+            'task': stage_config['task'],
+            'params': stage_config.get('params', {}),
+            'upstream': {dependency: self.keys[dependency] for dependency in sorted(self.graph[name])},
+            'files': _fingerprints({k: v for k, v in params.items() if not k.startswith(('output', 'cache'))})
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_folder, key + '.pickle')
+
+    def _run_stage(self, name):
+        stage_config = self.stages[name]
+        params = _substitute(stage_config.get('params', {}), self.results)
+        key = self._cache_key(name, params)
+        self.keys[name] = key
+        cache_path = self._cache_path(key)
+
+        if not stage_config.get('always_run', False) and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as cached:
+                result, output_fingerprint = pickle.load(cached)
+            # Cached result is valid only if files written by the stage were not changed or removed since then
+            if _fingerprints(result) == output_fingerprint and not _missing_outputs(params):
+                logger.info('Stage {} is up to date (cache key {})'.format(name, key[:12]))
+                return name, result, 'cached'
+
+        logger.info('Stage {} started'.format(name))
+        task = _resolve_task(stage_config['task'])
+        result = task(**params)
+        missing = _missing_outputs(params)
+        if missing:
+            # Stage without its outputs failed (as example the download without credentials), it is not cached
+            raise FileNotFoundError('Stage {} did not write its outputs: {}'.format(name, ', '.join(missing)))
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        temporary_path = cache_path + '.tmp'
+        with open(temporary_path, 'wb') as cached:
+            pickle.dump((result, _fingerprints(result)), cached, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+        logger.info('Stage {} finished'.format(name))
+        return name, result, 'run'
+
+    def run(self, targets=None):
+        """
+        Method runs the pipeline.
+        :param targets: list of stages to run together with their upstream stages, if None then all stages are run,
+        :return status: dictionary {stage name: 'run' or 'cached'}
+        """
+        graph = self.graph
+        if targets is not None:
+            graph = {name: self.graph[name] for name in self._upstream(targets)}
+
+        sorter = graphlib.TopologicalSorter(graph)
+        sorter.prepare()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = set()
+            while sorter.is_active():
+                for name in sorter.get_ready():
+                    running.add(executor.submit(self._run_stage, name))
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    # Exception of the stage stops the pipeline, stages already running are finished
+                    name, result, status = future.result()
+                    self.results[name] = result
+                    self.status[name] = status
+                    sorter.done(name)
+        return self.status
+
+    def _upstream(self, targets):
+        selected = set()
+        to_visit = list(targets)
+        while to_visit:
+            name = to_visit.pop()
+            if name not in self.graph:
+                raise KeyError('Stage {} is not defined'.format(name))
+            if name not in selected:
+                selected.add(name)
+                to_visit.extend(self.graph[name])
+        return selected
+
+
+def run_pipeline(config_file, targets=None, cache_folder=None, workers=None):
+    """Function runs the pipeline described in the config file and returns results of all stages"""
+    pipeline = Pipeline(config_file, cache_folder=cache_folder, workers=workers)
+    pipeline.run(targets)
+    return pipeline.results
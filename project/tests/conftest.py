@@ -0,0 +1,11 @@
+"""Test fixtures
+Tests run offline on small synthetic inputs. Run from the project folder:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_FOLDER not in sys.path:
+    sys.path.insert(0, PROJECT_FOLDER)
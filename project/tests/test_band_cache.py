@@ -0,0 +1,27 @@
+import numpy as np
+
+from b_data_processing.scripts.band_cache import BandCache
+
+
+def test_cached_band_is_read_only_and_array_of_the_caller_stays_writeable():
+    cache = BandCache(max_bytes=1024)
+    band = np.zeros((4, 4), dtype=np.uint16)
+    cached = cache.put('band', band, metadata='metadata')
+
+    assert band.flags.writeable
+    assert not cached.flags.writeable
+    stored, metadata = cache.get('band')
+    assert not stored.flags.writeable and metadata == 'metadata'
+    band[0, 0] = 1
+
+
+def test_least_recently_used_bands_are_evicted_over_the_budget():
+    cache = BandCache(max_bytes=3 * 32)
+    for key in 'abc':
+        cache.put(key, np.zeros(16, dtype=np.uint16))
+    cache.get('a')
+    cache.put('d', np.zeros(16, dtype=np.uint16))
+
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    assert cache.statistics()['evictions'] == 1
@@ -0,0 +1,42 @@
+import zipfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pa_ds
+
+from d_data_export_and_visualization.export_data import export_to_parquet, iter_occurrences
+
+
+def _gbif_archive(path):
+    # Records of the first chunk have no eventDate and year, they appear only in the next chunks
+    lines = ['gbifID\tspecies\tcountryCode\tdecimalLongitude\tdecimalLatitude\teventDate\tyear\tmonth\tother']
+    for i in range(6):
+        event_date, year = ('', '') if i < 3 else ('2019-05-0{}T00:00:00'.format(i), '2019')
+        lines.append('{}\tIxodes ricinus\tPL\t{}\t52.1\t{}\t{}\t5\tx'.format(i, 20 + i * 0.1, event_date, year))
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('occurrence.txt', '\n'.join(lines) + '\n')
+    return path
+
+
+def test_occurrence_columns_empty_in_the_first_chunk_are_exported(tmp_path):
+    archive = _gbif_archive(str(tmp_path / 'occurrences.zip'))
+    output = str(tmp_path / 'occurrences')
+    schema = export_to_parquet(iter_occurrences(archive, batch_size=3), output)
+
+    assert schema.field('eventDate').type == pa.string()
+    assert schema.field('year').type == pa.int16()
+    table = pa_ds.dataset(output, format='parquet').to_table().to_pandas()
+    assert len(table) == 6
+    assert table['eventDate'].isna().sum() == 3
+    assert 'other' not in table.columns
+
+
+def test_columns_without_values_in_the_first_batch_are_promoted_to_text(tmp_path):
+    batches = [pd.DataFrame({'x': [1.0, 2.0], 'label': [None, None]}),
+               pd.DataFrame({'x': [3.0], 'label': ['forest']})]
+    output = str(tmp_path / 'points')
+    export_to_parquet(batches, output)
+
+    table = pa_ds.dataset(output, format='parquet').to_table().to_pandas().sort_values('x')
+    assert table['label'].isna().tolist() == [True, True, False]
+    assert table['label'].iloc[2] == 'forest'
@@ -0,0 +1,51 @@
+import glob
+import logging
+import os
+
+import numpy as np
+import pytest
+
+rio = pytest.importorskip('rasterio')
+
+from d_data_export_and_visualization.export_to_web import TilePyramid  # noqa: E402
+
+
+def _raster(path, scale=1.0):
+    from rasterio.transform import from_bounds
+
+    band = (np.arange(64 * 64, dtype=np.float32).reshape(64, 64) + 1) * scale
+    with rio.open(path, 'w', driver='GTiff', height=64, width=64, count=1, dtype='float32', crs='EPSG:4326',
+                  transform=from_bounds(14.0, 49.0, 24.0, 55.0, 64, 64), nodata=0) as dst:
+        dst.write(band, 1)
+    return path
+
+
+def _tiles(folder, extension):
+    return glob.glob(os.path.join(folder, '*', '*', '*.' + extension))
+
+
+def test_tiles_of_the_previous_format_are_removed(tmp_path):
+    raster = _raster(str(tmp_path / 'map.tif'))
+    output = str(tmp_path / 'tiles')
+    TilePyramid(raster, output, min_zoom=0, max_zoom=3, workers=1).build()
+    png_tiles = _tiles(output, 'png')
+    assert png_tiles
+
+    summary = TilePyramid(raster, output, min_zoom=0, max_zoom=3, image_format='webp', workers=1).build()
+    assert _tiles(output, 'png') == []
+    assert len(_tiles(output, 'webp')) == len(png_tiles)
+    assert summary['removed'] == len(png_tiles)
+
+
+def test_values_outside_the_stored_range_are_reported(tmp_path, caplog):
+    output = str(tmp_path / 'tiles')
+    TilePyramid(_raster(str(tmp_path / 'map.tif')), output, min_zoom=0, max_zoom=1, workers=1).build()
+
+    with caplog.at_level(logging.WARNING):
+        TilePyramid(_raster(str(tmp_path / 'map.tif')), output, min_zoom=0, max_zoom=1, workers=1)
+    assert caplog.records == []
+
+    with caplog.at_level(logging.WARNING):
+        pyramid = TilePyramid(_raster(str(tmp_path / 'map.tif'), scale=2.0), output, min_zoom=0, max_zoom=1, workers=1)
+    assert pyramid.vmax == 64 * 64
+    assert 'outside the value range' in caplog.text
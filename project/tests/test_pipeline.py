@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline
+
+# Calls of the test tasks as (stage label, start time, end time)
+CALLS = []
+CALLS_LOCK = threading.Lock()
+
+
+def record_call(label, delay=0.0, **params):
+    start = time.perf_counter()
+    time.sleep(delay)
+    with CALLS_LOCK:
+        CALLS.append((label, start, time.perf_counter()))
+    return {'label': label, 'params': params}
+
+
+def write_file(input_file, output_file, suffix=''):
+    with open(input_file, 'r') as source, open(output_file, 'w') as target:
+        target.write(source.read() + suffix)
+    record_call('write', path=output_file)
+    return {'path': output_file, 'size': os.path.getsize(output_file)}
+
+
+def write_file_to_path(input_file, path):
+    return write_file(input_file, path)
+
+
+def skip_write(input_file, output_file):
+    # Task which fails silently, as example the download without configured credentials
+    record_call('skip', path=output_file)
+    return output_file
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    CALLS.clear()
+    yield
+    CALLS.clear()
+
+
+def labels():
+    return [call[0] for call in CALLS]
+
+
+def test_stages_run_in_dependency_order(tmp_path):
+    config = {'stages': {
+        'c': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'c', 'upstream': ['@a', '@b']}},
+        'a': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'a', 'delay': 0.05}},
+        'b': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'b', 'delay': 0.05}},
+        'd': {'task': 'tests.test_pipeline:record_call', 'depends_on': ['c'], 'params': {'label': 'd'}}
+    }}
+    status = Pipeline(config, cache_folder=str(tmp_path / 'cache'), workers=2).run()
+
+    assert status == {'a': 'run', 'b': 'run', 'c': 'run', 'd': 'run'}
+    assert labels()[2:] == ['c', 'd']
+    calls = {label: (start, end) for label, start, end in CALLS}
+    # Independent stages a and b overlap, c starts after both of them
+    assert calls['a'][0] < calls['b'][1] and calls['b'][0] < calls['a'][1]
+    assert calls['c'][0] >= max(calls['a'][1], calls['b'][1])
+
+
+def test_targets_run_only_upstream_stages(tmp_path):
+    config = {'stages': {
+        'a': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'a'}},
+        'b': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'b', 'x': '@a'}},
+        'other': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'other'}}
+    }}
+    status = Pipeline(config, cache_folder=str(tmp_path / 'cache')).run(targets=['b'])
+    assert status == {'a': 'run', 'b': 'run'}
+
+
+def test_cycles_and_unknown_stages_are_rejected(tmp_path):
+    import graphlib
+
+    cycle = {'stages': {
+        'a': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'a', 'x': '@b'}},
+        'b': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'b', 'x': '@a'}}
+    }}
+    with pytest.raises(graphlib.CycleError):
+        Pipeline(cycle, cache_folder=str(tmp_path))
+    unknown = {'stages': {'a': {'task': 'tests.test_pipeline:record_call', 'params': {'x': '@missing'}}}}
+    with pytest.raises(KeyError):
+        Pipeline(unknown, cache_folder=str(tmp_path))
+
+
+def test_stage_key_references_are_resolved(tmp_path):
+    config = {'stages': {
+        'source': {'task': 'tests.test_pipeline:record_call', 'params': {'label': 'source', 'value': 3}},
+        'consumer': {'task': 'tests.test_pipeline:record_call',
+                     'params': {'label': 'consumer', 'whole': '@source', 'label_of_source': '@source.label',
+                                'nested': {'items': ['@source.params', 1]}}}
+    }}
+    pipeline = Pipeline(config, cache_folder=str(tmp_path / 'cache'))
+    pipeline.run()
+
+    params = pipeline.results['consumer']['params']
+    assert params['whole'] == {'label': 'source', 'params': {'value': 3}}
+    assert params['label_of_source'] == 'source'
+    assert params['nested'] == {'items': [{'value': 3}, 1]}
+
+
+def _file_config(tmp_path, task='tests.test_pipeline:write_file', output_param='output_file', suffix=''):
+    return {'stages': {
+        'copy': {'task': task, 'params': {'input_file': str(tmp_path / 'input.txt'),
+                                          output_param: str(tmp_path / 'copy.txt')}},
+        'summary': {'task': 'tests.test_pipeline:record_call',
+                    'params': {'label': 'summary', 'size': '@copy.size', 'suffix': suffix}}
+    }}
+
+
+def test_unchanged_stages_are_read_from_cache(tmp_path):
+    (tmp_path / 'input.txt').write_text('data')
+    cache = str(tmp_path / 'cache')
+
+    assert Pipeline(_file_config(tmp_path), cache_folder=cache).run() == {'copy': 'run', 'summary': 'run'}
+    CALLS.clear()
+    pipeline = Pipeline(_file_config(tmp_path), cache_folder=cache)
+    assert pipeline.run() == {'copy': 'cached', 'summary': 'cached'}
+    assert CALLS == []
+    assert pipeline.results['summary']['params']['size'] == 4
+
+
+def test_changed_input_file_invalidates_stage_and_downstream(tmp_path):
+    (tmp_path / 'input.txt').write_text('data')
+    cache = str(tmp_path / 'cache')
+    Pipeline(_file_config(tmp_path), cache_folder=cache).run()
+
+    (tmp_path / 'input.txt').write_text('new data')
+    pipeline = Pipeline(_file_config(tmp_path), cache_folder=cache)
+    assert pipeline.run() == {'copy': 'run', 'summary': 'run'}
+    assert pipeline.results['summary']['params']['size'] == 8
+
+
+def test_changed_params_invalidate_only_the_stage(tmp_path):
+    (tmp_path / 'input.txt').write_text('data')
+    cache = str(tmp_path / 'cache')
+    Pipeline(_file_config(tmp_path), cache_folder=cache).run()
+
+    status = Pipeline(_file_config(tmp_path, suffix='!'), cache_folder=cache).run()
+    assert status == {'copy': 'cached', 'summary': 'run'}
+
+
+def test_removed_output_invalidates_cached_result(tmp_path):
+    (tmp_path / 'input.txt').write_text('data')
+    cache = str(tmp_path / 'cache')
+    Pipeline(_file_config(tmp_path), cache_folder=cache).run()
+
+    os.remove(str(tmp_path / 'copy.txt'))
+    status = Pipeline(_file_config(tmp_path), cache_folder=cache).run()
+    assert status['copy'] == 'run'
+    assert (tmp_path / 'copy.txt').exists()
+
+
+def test_missing_output_fails_stage_and_is_not_cached(tmp_path):
+    (tmp_path / 'input.txt').write_text('data')
+    cache = str(tmp_path / 'cache')
+    config = _file_config(tmp_path, task='tests.test_pipeline:skip_write')
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            Pipeline(config, cache_folder=cache).run(targets=['copy'])
+    assert labels() == ['skip', 'skip']
+    assert not os.path.exists(cache) or not os.listdir(cache)
+
+
+def test_outputs_written_into_not_output_params_are_never_cached(tmp_path):
+    # Documented rule: params with files written by the task must start with 'output'
+    (tmp_path / 'input.txt').write_text('data')
+    cache = str(tmp_path / 'cache')
+    config = _file_config(tmp_path, task='tests.test_pipeline:write_file_to_path', output_param='path')
+    Pipeline(config, cache_folder=cache).run()
+    time.sleep(0.01)
+    assert Pipeline(config, cache_folder=cache).run()['copy'] == 'run'
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from b_data_processing.scripts.prefetch import PrefetchReader
+
+
+class FakeReader:
+    """Reader which fills bands with the index of the file, it counts arrays allocated instead of reusing buffers"""
+
+    def __init__(self, shape=(4, 4), delay=0.0, fail_on=None):
+        self.shape = shape
+        self.delay = delay
+        self.fail_on = fail_on
+        self.allocations = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, path, datasets, out=None):
+        time.sleep(self.delay)
+        if path == self.fail_on:
+            raise IOError('Cannot decode {}'.format(path))
+        bands = []
+        for i, _ in enumerate(datasets):
+            band = None if out is None else out[i]
+            if band is None:
+                with self.lock:
+                    self.allocations = self.allocations + 1
+                band = np.empty(self.shape, dtype=np.uint16)
+            band[:] = int(path.split('_')[1])
+            bands.append(band)
+        return bands, ['metadata of {}'.format(path)] * len(datasets)
+
+
+def _paths(number_of_files):
+    return ['file_{}'.format(i) for i in range(number_of_files)]
+
+
+def _consume_in_thread(consumer, timeout=5):
+    # Consumer which hangs fails the test instead of blocking the test run
+    errors = []
+
+    def run():
+        try:
+            consumer()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'Prefetch reader did not stop'
+    return errors
+
+
+@pytest.mark.parametrize('depth, workers', [(1, None), (2, None), (4, 3)])
+def test_each_path_is_yielded_exactly_once_with_its_bands(depth, workers):
+    paths = _paths(25)
+    with PrefetchReader(paths, [0, 1], depth=depth, workers=workers, reader=FakeReader()) as reader:
+        seen = []
+        for path, bands, metadata in reader:
+            assert len(bands) == 2
+            assert all((band == int(path.split('_')[1])).all() for band in bands)
+            assert metadata == ['metadata of {}'.format(path)] * 2
+            seen.append(path)
+    assert sorted(seen) == sorted(paths)
+
+
+@pytest.mark.parametrize('depth', [1, 2, 3])
+def test_buffers_are_reused(depth):
+    fake_reader = FakeReader(delay=0.001)
+    datasets = [0, 4, 1]
+    with PrefetchReader(_paths(30), datasets, depth=depth, reader=fake_reader) as reader:
+        assert len(list(reader)) == 30
+    assert fake_reader.allocations <= (depth + 1) * len(datasets)
+
+
+def test_reader_exception_is_raised_in_the_consumer():
+    reader = PrefetchReader(_paths(10), [0], depth=2, reader=FakeReader(fail_on='file_5'))
+
+    def consume():
+        with reader:
+            for _ in reader:
+                pass
+
+    errors = _consume_in_thread(consume)
+    assert len(errors) == 1 and isinstance(errors[0], IOError)
+    assert 'file_5' in str(errors[0])
+    assert reader._threads == []
+
+
+def test_early_stop_shuts_workers_down():
+    reader = PrefetchReader(_paths(200), [0], depth=3, reader=FakeReader(delay=0.01))
+
+    def consume():
+        with reader:
+            for i, _ in enumerate(reader):
+                if i == 2:
+                    break
+
+    assert _consume_in_thread(consume) == []
+    assert reader._threads == []
+
+
+def test_closed_iterator_stops_workers_started_by_itself():
+    reader = PrefetchReader(_paths(200), [0], depth=2, reader=FakeReader(delay=0.01))
+
+    def consume():
+        iterator = iter(reader)
+        next(iterator)
+        iterator.close()
+
+    assert _consume_in_thread(consume) == []
+    assert reader._threads == []
@@ -0,0 +1,22 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pyproj')
+sparse = pytest.importorskip('scipy.sparse')
+
+from b_data_processing.process_climate_data import load_weights, same_grid, save_weights, weights_grid  # noqa: E402
+
+
+@pytest.mark.parametrize('name', ['era5_h18v03', 'era5_h18v03.npz', os.path.join('weights', 'era5_h18v03')])
+def test_weights_are_stored_under_the_given_name(tmp_path, name):
+    weights_file = str(tmp_path / name)
+    weights = sparse.random(6, 4, density=0.5, format='csr', random_state=0)
+    grid = weights_grid([55.0, 54.75], [14.0, 14.25], (0.0, 1000.0, 0.0, 0.0, 0.0, -1000.0), (2, 3), 'EPSG:4326')
+    save_weights(weights_file, weights, grid)
+
+    assert os.listdir(os.path.dirname(weights_file)) == [os.path.basename(weights_file)]
+    stored_weights, stored_grid = load_weights(weights_file)
+    np.testing.assert_array_equal(stored_weights.toarray(), weights.toarray())
+    assert same_grid(grid, stored_grid)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from b_data_processing.scripts.process_modis import (BandMetadata, QC_FLAGS, export_composite, physical_scale,
+                                                     qc_lookup_table, qc_mask, scale_is_divisor)
+
+GEOTRANSFORM = (0.0, 1000.0, 0.0, 0.0, 0.0, -1000.0)
+
+
+def test_mod13_scale_factor_is_the_divisor():
+    assert scale_is_divisor('MOD13C2.A2001001.h18v03.006.2016006151003.hdf')
+    assert scale_is_divisor('/data/MYD13A3.A2001001.h18v03.006.2016006151003.hdf')
+    assert not scale_is_divisor('MOD11B3.A2001001.h18v03.006.2016006151003.hdf')
+
+    assert physical_scale(10000.0, 0.0, divisor=True) == (1e-4, 0.0)
+    assert physical_scale(0.02, None, divisor=False) == (0.02, 0.0)
+    # Scale already given as the multiplier is not inverted
+    assert physical_scale(1e-4, 0.0, divisor=True) == (1e-4, 0.0)
+
+
+@pytest.mark.parametrize('product, scale_factor, expected', [
+    ('MOD13C2', 10000.0, [0.5, -0.2]),  # NDVI
+    ('MOD11B3', 0.02, [100.0, -40.0])  # LST in Kelvin, raw values are not valid LST, only the convention is tested
+])
+def test_export_composite_applies_the_product_scale_convention(tmp_path, product, scale_factor, expected):
+    rio = pytest.importorskip('rasterio')
+    path = '{}.A2001001.h18v03.006.2016006151003.hdf'.format(product)
+    scale, offset = physical_scale(scale_factor, 0.0, scale_is_divisor(path))
+    band = np.array([[5000, -2000], [-3000, -3000]], dtype=np.int16)
+    metadata = BandMetadata(np.dtype('int16'), scale, offset, -3000, GEOTRANSFORM, '')
+
+    output = export_composite(band, metadata, str(tmp_path / 'composite.tif'))
+    with rio.open(output) as src:
+        values = src.read(1)
+    np.testing.assert_allclose(values[0], expected, rtol=1e-6)
+    assert np.isnan(values[1]).all()
+
+
+@pytest.mark.parametrize('flags, bits, accepted, rejected', [
+    # MODLAND QA (bits 0-1): 00 and 01 are accepted, other bits are not checked
+    ('MOD11', 8, [0b00000000, 0b00000001, 0b11111100, 0b10000001], [0b00000010, 0b00000011, 0b11111111]),
+    ('MOD11_GOOD', 8, [0b00000000, 0b11110000], [0b00000001, 0b00000010]),
+    # MOD13 VI usefulness (bits 2-5) from 0 to 3 is accepted together with the good MODLAND QA
+    ('MOD13_GOOD', 16, [0b0000000000000000, 0b0000000000001100, 0b1111111111000000],
+     [0b0000000000000001, 0b0000000000010000, 0b0000000000111100])
+])
+def test_qc_lookup_table_accepts_explicit_bit_patterns(flags, bits, accepted, rejected):
+    lookup_table = qc_lookup_table(QC_FLAGS[flags], bits)
+    assert lookup_table.shape == (2 ** bits,)
+    assert lookup_table[accepted].all()
+    assert not lookup_table[rejected].any()
+
+
+@pytest.mark.parametrize('dtype, flags, values, expected', [
+    ('uint8', 'MOD11', [0b00000001, 0b00000010], [True, False]),
+    # Signed layers are read bit by bit: -4 is 0b11111100 and -1 is 0b11111111
+    ('int8', 'MOD11', [-4, -1, 1, 2], [True, False, True, False]),
+    ('uint16', 'MOD13_GOOD', [0b1000000000000000, 0b0000000000010000], [True, False]),
+    # -32768 is 0b1000000000000000, -32756 is 0b1000000000001100 and -32752 is 0b1000000000010000
+    ('int16', 'MOD13_GOOD', [-32768, -32756, -32752, -1], [True, True, False, False])
+])
+def test_qc_mask_reads_qc_values_bit_by_bit(dtype, flags, values, expected):
+    qc_band = np.array(values, dtype=dtype).reshape(2, -1)
+    lookup_table = qc_lookup_table(QC_FLAGS[flags], np.dtype(dtype).itemsize * 8)
+    mask = qc_mask(qc_band, lookup_table)
+    assert mask.shape == qc_band.shape
+    assert mask.ravel().tolist() == expected
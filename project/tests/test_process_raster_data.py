@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from b_data_processing.process_raster_data import ModisProcessing
+from b_data_processing.scripts.process_modis import QC_FLAGS, BandMetadata
+
+
+class FakeReader:
+    """Reader of the synthetic HDF files given as {path: {subdataset: band}}, it records requested subdatasets"""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    def read_subdatasets(self, path, datasets, out=None):
+        self.requests.append(list(datasets))
+        bands = [self.files[path][ds] for ds in datasets]
+        metadata = [BandMetadata(band.dtype, 1.0, 0.0, 0, None, None) for band in bands]
+        return bands, metadata
+
+
+def _files():
+    # LST Day (0) is rejected by QC_Day (1) in the first file, LST Night (4) by QC_Night (5) in the second file
+    accepted = np.zeros((2, 2), dtype=np.uint8)
+    rejected = np.full((2, 2), 2, dtype=np.uint8)
+    return {
+        'a.hdf': {0: np.full((2, 2), 10, dtype=np.uint16), 1: rejected, 4: np.full((2, 2), 20, dtype=np.uint16),
+                  5: accepted},
+        'b.hdf': {0: np.full((2, 2), 30, dtype=np.uint16), 1: accepted, 4: np.full((2, 2), 40, dtype=np.uint16),
+                  5: rejected}
+    }
+
+
+def test_each_subdataset_is_masked_by_its_qc_subdataset():
+    reader = FakeReader(_files())
+    mp = ModisProcessing(subdatasets=[0, 4], qc_subdataset={0: 1, 4: 5}, qc_flags=QC_FLAGS['MOD11'], prefetch=0,
+                         band_cache=reader)
+    means, _ = mp._process_eo(['a.hdf', 'b.hdf'])
+
+    assert (means[0] == 30).all()
+    assert (means[1] == 20).all()
+    assert reader.requests == [[0, 4, 1, 5], [0, 4, 1, 5]]
+
+
+def test_single_qc_subdataset_masks_all_subdatasets_and_is_read_once():
+    reader = FakeReader(_files())
+    # Keys of the mapping read from the config file are strings
+    mp = ModisProcessing(subdatasets=[0, 4], qc_subdataset=1, qc_flags=QC_FLAGS['MOD11'], prefetch=0,
+                         band_cache=reader)
+    assert mp.qc_subsets == ModisProcessing(subdatasets=[0, 4], qc_subdataset={'0': '1', '4': '1'},
+                                            qc_flags=QC_FLAGS['MOD11']).qc_subsets
+    means, _ = mp._process_eo(['a.hdf', 'b.hdf'])
+
+    assert (means[0] == 30).all()
+    assert (means[1] == 40).all()
+    assert reader.requests == [[0, 4, 1], [0, 4, 1]]
+
+
+def test_subdatasets_without_qc_subdataset_are_not_masked():
+    mp = ModisProcessing(subdatasets=[0, 4], qc_subdataset={4: 5}, qc_flags=QC_FLAGS['MOD11'], prefetch=0,
+                         band_cache=FakeReader(_files()))
+    means, _ = mp._process_eo(['a.hdf', 'b.hdf'])
+
+    assert (means[0] == 20).all()
+    assert (means[1] == 20).all()
+
+
+def test_qc_subdataset_of_not_processed_subdataset_is_rejected():
+    with pytest.raises(ValueError):
+        ModisProcessing(subdatasets=[0], qc_subdataset={4: 5}, qc_flags=QC_FLAGS['MOD11'])